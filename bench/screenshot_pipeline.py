@@ -0,0 +1,376 @@
+"""Offline benchmark for the screenshot pipeline.
+
+Generates synthetic videos with ffmpeg's testsrc, serves them from a local
+HTTP server with Range support, and drives the url-cb / tg-cb screenshot jobs
+against fake Telegram objects that record every API call and inject latency
+and FloodWait errors.
+
+    python bench/screenshot_pipeline.py --shots 2,5,10 --concurrency 1,4,8
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import importlib
+import resource
+import tempfile
+import threading
+import subprocess
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+for key, value in dict(
+    API_ID='1',
+    API_HASH='bench',
+    BOT_TOKEN='1:bench',
+    SESSION_NAME='bench',
+    USER_SESSION_STRING='bench_user',
+    MIDDLE_MAN='0',
+    LINK_GEN_BOT='bench_link_bot',
+    LOG_CHANNEL='0',
+    DATABASE_URL='mongodb://127.0.0.1:27017',
+    AUTH_USERS='0',
+).items():
+    os.environ.setdefault(key, value)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyrogram.errors import FloodWait
+
+from bot import db
+from bot.utils import metrics, ProgressReporter
+
+
+STAGES = (
+    'link_generation_seconds', 'probe_seconds', 'keyframe_probe_seconds', 'ffmpeg_seek_seconds',
+    'ffmpeg_batch_seconds', 'upload_seconds', 'job_seconds'
+)
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+
+    root = None
+    latency = 0
+    bytes_sent = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def do_GET(self):
+        self._serve(head=False)
+
+    def _serve(self, head):
+        time.sleep(self.latency)
+        path = os.path.join(self.root, os.path.basename(self.path.split('?')[0]))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        byte_range = self.headers.get('Range')
+        if byte_range and byte_range.startswith('bytes='):
+            first, _, last = byte_range[6:].split(',')[0].partition('-')
+            start = int(first) if first else max(0, size - int(last))
+            end = min(int(last), size - 1) if first and last else size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if head:
+            return
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            try:
+                while remaining:
+                    chunk = f.read(min(64*1024, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+                    with self.lock:
+                        RangeRequestHandler.bytes_sent += len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+
+def start_http_server(root, latency):
+    RangeRequestHandler.root = root
+    RangeRequestHandler.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def generate_video(folder, duration, size, gop):
+    path = os.path.join(folder, f'testsrc_{duration}s_{size}.mp4')
+    if not os.path.exists(path):
+        subprocess.run(
+            [
+                'ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', f'testsrc=duration={duration}:size={size}:rate=25',
+                '-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(gop), '-pix_fmt', 'yuv420p', path
+            ],
+            check=True
+        )
+    return path
+
+
+def make_flood_wait(seconds):
+    error = FloodWait.__new__(FloodWait)
+    error.x = seconds
+    return error
+
+
+class FakeTelegram:
+
+    def __init__(self, api_latency, flood_rate, flood_seconds, upload_bandwidth):
+        self.api_latency = api_latency
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.upload_bandwidth = upload_bandwidth
+        self.calls = {}
+
+    async def call(self, name, upload_bytes=0):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        await asyncio.sleep(self.api_latency)
+        if random.random() < self.flood_rate:
+            self.calls['FloodWait'] = self.calls.get('FloodWait', 0) + 1
+            raise make_flood_wait(self.flood_seconds)
+        if upload_bytes and self.upload_bandwidth:
+            await asyncio.sleep(upload_bytes / self.upload_bandwidth)
+
+
+def media_size(media):
+    if hasattr(media, 'getbuffer'):
+        return media.getbuffer().nbytes
+    if os.path.exists(media):
+        return os.path.getsize(media)
+    # a file_id resent from the result cache
+    return 0
+
+
+def sent_message(caption, photo):
+    sent = SimpleNamespace(file_id=f'bench_file_{random.getrandbits(64):x}')
+    return SimpleNamespace(caption=caption, photo=sent if photo else None, document=None if photo else sent)
+
+
+def make_callback(telegram, user_id, data, media_msg):
+
+    async def edit_message_text(text, **kwargs):
+        await telegram.call('edit_message_text')
+
+    async def answer(*args, **kwargs):
+        await telegram.call('answer')
+
+    return SimpleNamespace(
+        data=data,
+        from_user=SimpleNamespace(id=user_id, first_name='bench'),
+        message=SimpleNamespace(reply_to_message=media_msg, chat=SimpleNamespace(id=user_id)),
+        edit_message_text=edit_message_text,
+        answer=answer
+    )
+
+
+def make_media_msg(telegram, user_id, message_id, file_unique_id, text=None):
+
+    async def reply_chat_action(action):
+        await telegram.call('send_chat_action')
+
+    async def reply_media_group(media, quote=None):
+        await telegram.call('send_media_group', sum(media_size(item.media) for item in media))
+        return [sent_message(item.caption, photo=True) for item in media]
+
+    async def reply_document(document, quote=None, caption=None, **kwargs):
+        await telegram.call('send_document', media_size(document))
+        return sent_message(caption, photo=False)
+
+    async def forward(chat_id):
+        await telegram.call('forward_messages')
+
+    return SimpleNamespace(
+        empty=False,
+        text=text,
+        video=SimpleNamespace(file_id=file_unique_id, file_unique_id=file_unique_id),
+        document=None,
+        message_id=message_id,
+        chat=SimpleNamespace(id=user_id),
+        reply_chat_action=reply_chat_action,
+        reply_media_group=reply_media_group,
+        reply_document=reply_document,
+        forward=forward
+    )
+
+
+def patch_database(as_file, settings):
+    results = {}
+
+    async def is_as_file(id):
+        return as_file
+
+    async def get_output_settings(id):
+        return dict(settings)
+
+    async def get_screenshot_result(key):
+        return results.get(key)
+
+    async def save_screenshot_result(key, media):
+        results[key] = dict(media=media)
+
+    async def delete_screenshot_result(key):
+        results.pop(key, None)
+
+    db.is_as_file = is_as_file
+    db.get_output_settings = get_output_settings
+    db.get_screenshot_result = get_screenshot_result
+    db.save_screenshot_result = save_screenshot_result
+    db.delete_screenshot_result = delete_screenshot_result
+
+
+def patch_link_generator(telegram, file_link, link_latency):
+    # only the round trip to the link generator is faked, so the stream link
+    # cache and request coalescing in front of it still run.
+    from bot.utils import utils
+
+    async def request_stream_link(media_msg):
+        await telegram.call('forward_messages')
+        await telegram.call('get_messages')
+        await telegram.call('forward_messages')
+        await asyncio.sleep(link_latency)
+        await telegram.call('read_history')
+        return file_link
+
+    utils._request_stream_link = request_stream_link
+
+
+def patch_uploader(telegram):
+    # album mode talks to the raw API through the message's client, which the
+    # fake messages do not have.
+    from bot.utils import uploader
+
+    async def upload_photo(media_msg, media):
+        await telegram.call('upload_media', media_size(media))
+        return media
+
+    async def send_uploaded_photos(media_msg, photos):
+        await telegram.call('send_media_group')
+        return [sent_message(caption, photo=True) for _, caption in photos]
+
+    uploader.upload_photo = upload_photo
+    uploader.send_uploaded_photos = send_uploaded_photos
+
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+async def run_level(args, plugin, telegram, file_link, shots, concurrency):
+    metrics.reset()
+    telegram.calls.clear()
+    RangeRequestHandler.bytes_sent = 0
+    peak_rss = rss_kb()
+    done = False
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while not done:
+            peak_rss = max(peak_rss, rss_kb())
+            await asyncio.sleep(0.1)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    prefix = 'tg' if args.source == 'tg' else 'url'
+
+    async def run_job(i):
+        link = f'{file_link}?job={i}' if args.cold else file_link
+        file_unique_id = f'bench_{i}' if args.cold else 'bench'
+        media_msg = make_media_msg(telegram, 1000 + i % args.users, i, file_unique_id, None if args.source == 'tg' else link)
+        m = make_callback(telegram, media_msg.chat.id, f'{prefix}+{shots}', media_msg)
+        async with semaphore:
+            progress = ProgressReporter(m)
+            await plugin.screenshot_fn(None, m, progress)
+            await progress.wait_closed()
+
+    sampler = asyncio.ensure_future(sample_rss())
+    start = time.monotonic()
+    await asyncio.gather(*[run_job(i) for i in range(args.jobs)])
+    elapsed = time.monotonic() - start
+    done = True
+    await sampler
+
+    print(f"\n== shots={shots} concurrency={concurrency} jobs={args.jobs}")
+    print(f"throughput: {args.jobs / elapsed * 60:.1f} jobs/min ({elapsed:.1f}s total)")
+    print(f"source bytes read: {RangeRequestHandler.bytes_sent / 1024 / 1024:.1f} MiB")
+    print(f"peak rss: bot {peak_rss / 1024:.0f} MiB, largest ffmpeg {resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024:.0f} MiB")
+    for histogram in metrics.histograms():
+        if histogram.name in STAGES and histogram.count:
+            p50, p95, p99 = (histogram.percentile(q) for q in (0.5, 0.95, 0.99))
+            print(f"  {histogram.name:<26} n={histogram.count:<4} p50={p50:.3f}s p95={p95:.3f}s p99={p99:.3f}s")
+    print("  telegram calls: " + ', '.join(f"{name}={count}" for name, count in sorted(telegram.calls.items())))
+
+
+async def main(args):
+    random.seed(args.seed)
+    folder = args.workdir or tempfile.mkdtemp(prefix='screenshot_bench_')
+    video = generate_video(folder, args.duration, args.size, args.gop)
+    server = start_http_server(folder, args.http_latency)
+    file_link = f'http://127.0.0.1:{server.server_address[1]}/{os.path.basename(video)}'
+
+    telegram = FakeTelegram(args.api_latency, args.flood_rate, args.flood_seconds, args.upload_bandwidth * 1024 * 1024)
+    patch_database(args.as_file, dict(output_format=args.format, quality=args.quality, max_dimension=args.max_dimension))
+    patch_uploader(telegram)
+    plugin = importlib.import_module('bot.plugins.tg-cb' if args.source == 'tg' else 'bot.plugins.url-cb')
+    if args.source == 'tg':
+        patch_link_generator(telegram, file_link, args.link_latency)
+
+    for shots in args.shots:
+        for concurrency in args.concurrency:
+            await run_level(args, plugin, telegram, file_link, shots, concurrency)
+    server.shutdown()
+
+
+def int_list(value):
+    return [int(i) for i in value.split(',')]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', choices=('url', 'tg'), default='url')
+    parser.add_argument('--shots', type=int_list, default=[2, 5, 10])
+    parser.add_argument('--concurrency', type=int_list, default=[1, 4])
+    parser.add_argument('--jobs', type=int, default=8)
+    parser.add_argument('--users', type=int, default=4)
+    parser.add_argument('--cold', action='store_true', help='give every job its own source so caches miss')
+    parser.add_argument('--duration', type=int, default=600)
+    parser.add_argument('--size', default='1280x720')
+    parser.add_argument('--gop', type=int, default=250)
+    parser.add_argument('--workdir', help='folder for generated videos, reused between runs')
+    parser.add_argument('--http-latency', type=float, default=0.05, help='seconds added to every HTTP request')
+    parser.add_argument('--link-latency', type=float, default=1.0, help='link generator reply time in seconds')
+    parser.add_argument('--api-latency', type=float, default=0.1, help='seconds added to every Telegram call')
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='fraction of Telegram calls failing with FloodWait')
+    parser.add_argument('--flood-seconds', type=int, default=2)
+    parser.add_argument('--upload-bandwidth', type=float, default=5.0, help='MiB/s')
+    parser.add_argument('--as-file', action='store_true')
+    parser.add_argument('--format', choices=('png', 'jpeg', 'webp'), default='png')
+    parser.add_argument('--quality', type=int, default=85)
+    parser.add_argument('--max-dimension', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
@@ -1,18 +1,28 @@
 from config import Config
-from .main import get_bot_client, get_user_client
+from .main import get_bot_client, get_user_clients
 from .database import Database
 
 
 bot = get_bot_client()
-user = get_user_client()
+users = get_user_clients()
+user = users[0]
 db = Database(Config.DATABASE_URL)
 
 
 async def run_bot():
-    await user.start()
+    from .utils import register_link_gen_handler, log_sink, metrics
+    
+    await db.create_indexes()
+    for user in users:
+        register_link_gen_handler(user)
+        await user.start()
     await bot.start()
+    log_sink.start(bot)
+    if Config.METRICS_PORT:
+        await metrics.serve(Config.METRICS_PORT)
     
     await bot.idle()
     
     await bot.stop()
-    await user.stop()
+    for user in users:
+        await user.stop()
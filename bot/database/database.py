@@ -1,32 +1,106 @@
 import datetime
+from collections import OrderedDict
 
 import motor.motor_asyncio
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
 
 from config import Config
 
+
+DEFAULT_OUTPUT_SETTINGS = dict(
+    output_format = 'png',
+    quality = 85,
+    max_dimension = 0
+)
+
+
 class Database:
     
-    def __init__(self, uri):
+    def __init__(self, uri, cache_size=Config.USER_CACHE_SIZE):
         self._client = motor.motor_asyncio.AsyncIOMotorClient(uri)
         self.db = self._client[Config.SESSION_NAME]
         self.col = self.db.users
+        self.results = self.db.screenshot_results
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
     
     
     def new_user(self, id):
         return dict(
             id = id,
             join_date = datetime.date.today().isoformat(),
-            as_file=False
+            as_file=False,
+            **DEFAULT_OUTPUT_SETTINGS
         )
     
     
+    def is_customised(self, user):
+        return user.get('as_file', False) or any(user.get(key, value) != value for key, value in DEFAULT_OUTPUT_SETTINGS.items())
+    
+    
+    async def remove_duplicate_users(self):
+        # the old check-then-insert flow could store the same user twice. Of
+        # each group the first stored document that carries the user's own
+        # settings is kept, or else the first stored one.
+        duplicates = self.col.aggregate([
+            {'$sort': {'_id': 1}},
+            {'$group': {'_id': '$id', 'docs': {'$push': '$$ROOT'}, 'count': {'$sum': 1}}},
+            {'$match': {'count': {'$gt': 1}}}
+        ])
+        async for duplicate in duplicates:
+            docs = duplicate['docs']
+            keep = next((doc for doc in docs if self.is_customised(doc)), docs[0])
+            await self.col.delete_many({'_id': {'$in': [doc['_id'] for doc in docs if doc is not keep]}})
+    
+    
+    async def create_indexes(self):
+        try:
+            await self.col.create_index('id', unique=True)
+        except OperationFailure as e:
+            # only a collection that still holds duplicates fails here, so the
+            # cleanup never scans the users on a normal start.
+            if e.code != 11000:
+                raise
+            await self.remove_duplicate_users()
+            await self.col.create_index('id', unique=True)
+        await self.results.create_index('last_used')
+    
+    
+    def _cache_user(self, user):
+        self._cache[user['id']] = user
+        self._cache.move_to_end(user['id'])
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+    
+    
+    async def get_user(self, id):
+        id = int(id)
+        user = self._cache.get(id)
+        if user is not None:
+            self._cache.move_to_end(id)
+            return user
+        user = await self.col.find_one({'id':id})
+        if user is not None:
+            self._cache_user(user)
+        return user
+    
+    
+    async def ensure_user(self, id):
+        id = int(id)
+        if id in self._cache:
+            return False
+        user = {key: value for key, value in self.new_user(id).items() if key != 'id'}
+        result = await self.col.update_one({'id': id}, {'$setOnInsert': user}, upsert=True)
+        return result.upserted_id is not None
+    
+    
     async def add_user(self, id):
-        user = self.new_user(id)
-        await self.col.insert_one(user)
+        await self.ensure_user(id)
     
     
     async def is_user_exist(self, id):
-        user = await self.col.find_one({'id':int(id)})
+        user = await self.get_user(id)
         return True if user else False
     
     
@@ -35,11 +109,53 @@ class Database:
         return count
     
     
+    async def _update_user(self, id, fields):
+        user = await self.col.find_one_and_update(
+            {'id': int(id)},
+            {'$set': fields},
+            return_document=ReturnDocument.AFTER
+        )
+        if user is not None:
+            self._cache_user(user)
+    
+    
     async def is_as_file(self, id):
-        user = await self.col.find_one({'id':int(id)})
+        user = await self.get_user(id) or {}
         return user.get('as_file', False)
     
     
     async def update_as_file(self, id, as_file):
-        await self.col.update_one({'id': id}, {'$set': {'as_file': as_file}})
-        
+        await self._update_user(id, {'as_file': as_file})
+    
+    
+    async def get_output_settings(self, id):
+        user = await self.get_user(id) or {}
+        return {key: user.get(key, default) for key, default in DEFAULT_OUTPUT_SETTINGS.items()}
+    
+    
+    async def update_output_settings(self, id, **settings):
+        await self._update_user(id, settings)
+    
+    
+    async def get_screenshot_result(self, key):
+        return await self.results.find_one_and_update(
+            {'_id': key},
+            {'$set': {'last_used': datetime.datetime.utcnow()}, '$inc': {'hits': 1}}
+        )
+    
+    
+    async def save_screenshot_result(self, key, media, max_results=Config.RESULT_CACHE_SIZE):
+        now = datetime.datetime.utcnow()
+        await self.results.replace_one(
+            {'_id': key},
+            dict(media=media, created=now, last_used=now, hits=0),
+            upsert=True
+        )
+        excess = await self.results.estimated_document_count() - max_results
+        if excess > 0:
+            stale = self.results.find({}, {'_id': 1}).sort('last_used', 1).limit(excess)
+            await self.results.delete_many({'_id': {'$in': [doc['_id'] async for doc in stale]}})
+    
+    
+    async def delete_screenshot_result(self, key):
+        await self.results.delete_one({'_id': key})
@@ -18,10 +18,14 @@ def get_bot_client():
     return bot
 
 
-def get_user_client():
+def get_user_client(session_string=Config.USER_SESSION_STRING):
     user = pyrogram.Client(
-        Config.USER_SESSION_STRING,
+        session_string,
         api_id = Config.API_ID,
         api_hash = Config.API_HASH,
     )
     return user
+
+
+def get_user_clients():
+    return [get_user_client(session_string) for session_string in Config.USER_SESSION_STRINGS]
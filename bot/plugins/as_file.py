@@ -1,5 +1,6 @@
-from pyrogram import Client, Filters, InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram import Client, Filters
 from bot import db
+from bot.utils import get_settings_markup
 
 
 @Client.on_callback_query(Filters.create(lambda _, query: query.data.startswith('as_file')))
@@ -11,13 +12,4 @@ async def _(c, m):
     else:
         await db.update_as_file(m.from_user.id, False)
     
-    as_file = await db.is_as_file(m.from_user.id)
-    upload_mode_btn = [InlineKeyboardButton("📁 Uploading as Document.", 'as_file+0')] if as_file else [InlineKeyboardButton("🖼️ Uploading as Image.", 'as_file+1')]
-    
-    await m.edit_message_reply_markup(
-        InlineKeyboardMarkup(
-            [
-                upload_mode_btn
-            ]
-        )
-    )
+    await m.edit_message_reply_markup(await get_settings_markup(m.from_user.id))
@@ -0,0 +1,137 @@
+import os
+import uuid
+import shutil
+import time
+import asyncio
+import datetime
+import traceback
+
+from pyrogram import Client, Filters, InlineKeyboardMarkup, InlineKeyboardButton
+
+from config import Config
+from bot.utils import get_probe, get_media_key, generate_stream_link, edit_message_text, ProgressReporter, generate_clip, scheduler, log_sink, metrics
+
+
+# (chat id, message id) of the progress message -> (scheduler key, progress)
+running_clips = {}
+
+
+@Client.on_callback_query(Filters.create(lambda _, query: query.data.startswith('clip')))
+async def _(c, m):
+    media_msg = m.message.reply_to_message
+    if media_msg.empty:
+        await edit_message_text(m, text='Why did you delete the file 😠, Now i cannot help you 😒.')
+        return
+    
+    parts = m.data.split('+')
+    if len(parts) == 3:
+        await m.answer()
+        await media_msg.reply_text(
+            text=f"Choose where the {'gif' if parts[2] == 'gif' else 'clip'} of `{Config.CLIP_DURATION}s` should start.",
+            reply_markup=InlineKeyboardMarkup(
+                [
+                    [
+                        InlineKeyboardButton(f'⏩ {offset}%', f'{m.data}+{offset}') for offset in Config.CLIP_OFFSETS
+                    ]
+                ]
+            ),
+            quote=True
+        )
+        return
+    
+    progress = ProgressReporter(
+        m,
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton('🚫 Cancel', 'cancel_clip')]])
+    )
+    
+    async def on_position(position):
+        progress.update(f'⏳ Your request is queued at position `{position}`, Please wait!')
+    
+    key = (m.from_user.id, get_media_key(media_msg), m.data)
+    if not scheduler.submit(m.from_user.id, key, lambda: clip_fn(c, m, progress), on_position):
+        progress.cancel()
+        await m.answer('Your request is already being processed.')
+        return
+    running_clips[(m.message.chat.id, m.message.message_id)] = (key, progress)
+
+
+@Client.on_callback_query(Filters.create(lambda _, query: query.data == 'cancel_clip'))
+async def _(c, m):
+    job = running_clips.get((m.message.chat.id, m.message.message_id))
+    if job is None or job[0][0] != m.from_user.id:
+        await m.answer('Nothing to cancel.')
+        return
+    
+    key, progress = job
+    if scheduler.cancel(key):
+        # queued jobs never start, so nothing else will close their progress message.
+        running_clips.pop((m.message.chat.id, m.message.message_id), None)
+        progress.finish('🚫 Cancelled.')
+    await m.answer('Cancelled.')
+
+
+async def clip_fn(c, m, progress):
+    _, _, output_format, offset = m.data.split('+')
+    media_msg = m.message.reply_to_message
+    
+    uid = str(uuid.uuid4())
+    output_folder = Config.SCRST_OP_FLDR.joinpath(uid)
+    if not output_folder.exists():
+        os.makedirs(output_folder)
+    
+    try:
+        start_time = time.time()
+        
+        progress.update('Processing your request, Please wait! 😴')
+        
+        if media_msg.text:
+            file_link = media_msg.text
+        else:
+            file_link = await generate_stream_link(media_msg)
+            if file_link is None:
+                progress.finish("😟 Sorry! I cannot help you right now, I'm having hard time processing the file.")
+                log_sink.report(f'@{Config.LINK_GEN_BOT} did not respond with stream url', media_msg)
+                return
+        
+        info = await get_probe(get_media_key(media_msg), file_link)
+        if info is None:
+            progress.finish("😟 Sorry! I cannot open the file.")
+            log_sink.report(f'stream link : {file_link}\n\n Could not open the file.', media_msg)
+            return
+        
+        start = int(info['seconds'] * int(offset) / 100)
+        duration = max(1, min(Config.CLIP_DURATION, info['seconds'] - start))
+        
+        progress.update(f'✂️ Cutting your {output_format}!')
+        
+        clip = await generate_clip(file_link, start, duration, output_folder, info, output_format)
+        if clip is None:
+            progress.finish(f'😟 Sorry! {output_format} generation failed possibly due to some infrastructure failure 😥.')
+            log_sink.report(f'stream link : {file_link}\n\n{output_format} from {start}s could not be generated.', media_msg)
+            return
+        
+        progress.update('🤓 Now starting to upload!')
+        
+        await media_msg.reply_chat_action("upload_video")
+        
+        caption = f"Clip from {datetime.timedelta(seconds=start)} to {datetime.timedelta(seconds=start+duration)}"
+        with metrics.timer('clip_upload_seconds', 'Time to upload a clip or gif'):
+            if output_format == 'gif':
+                await media_msg.reply_animation(str(clip), quote=True, caption=caption)
+            else:
+                await media_msg.reply_video(str(clip), quote=True, caption=caption, duration=duration, supports_streaming=True)
+        
+        metrics.histogram('job_seconds', 'End to end time of successful jobs').observe(time.time()-start_time)
+        
+        progress.finish(f'Successfully completed process in {datetime.timedelta(seconds=int(time.time()-start_time))}')
+    except asyncio.CancelledError:
+        progress.finish('🚫 Cancelled.')
+        raise
+    except:
+        traceback.print_exc()
+        progress.finish('😟 Sorry! Clip generation failed possibly due to some infrastructure failure 😥.')
+        
+        log_sink.report(f'A {output_format} from {offset}% was requested and some error occoured\n\n{traceback.format_exc()}', media_msg)
+    finally:
+        running_clips.pop((m.message.chat.id, m.message.message_id), None)
+        shutil.rmtree(output_folder, ignore_errors=True)
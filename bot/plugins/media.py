@@ -2,7 +2,7 @@ import asyncio
 
 from pyrogram import Client, Filters, InlineKeyboardMarkup, InlineKeyboardButton
 
-from bot.utils import is_valid_file, generate_stream_link, get_duration
+from bot.utils import is_valid_file, generate_stream_link, get_probe, get_media_key, log_sink
 from config import Config
 
 
@@ -16,22 +16,17 @@ async def _(c, m):
     file_link = await generate_stream_link(m)
     if file_link is None:
         await snt.edit_text("😟 Sorry! I cannot help you right now, I'm having hard time processing the file.", quote=True)
-        l = await m.forward(Config.LOG_CHANNEL)
-        await l.reply_text(f'Could not create stream link', True)
+        log_sink.report(f'Could not create stream link', m)
         return
     
-    duration = await get_duration(file_link)
-    if duration is None:
+    info = await get_probe(get_media_key(m), file_link)
+    if info is None:
         await snt.edit_text("😟 Sorry! I cannot open the file.")
-        l = await m.forward(Config.LOG_CHANNEL)
-        await l.reply_text(f'stream link : {file_link}\n\n Could not open the file.', True)
+        log_sink.report(f'stream link : {file_link}\n\n Could not open the file.', m)
         return
     
-    hh, mm, ss = [int(i) for i in duration.split(":")]
-    seconds = hh*60*60 + mm*60 + ss
-    
     await snt.edit_text(
-        text=f"Hi, Choose the number of screenshots you need.\n\nTotal duration: `{duration}` (`{seconds}s`)",
+        text=f"Hi, Choose the number of screenshots you need.\n\nTotal duration: `{info['duration']}` (`{info['seconds']}s`)",
         reply_markup=InlineKeyboardMarkup(
             [
                 [
@@ -52,6 +47,16 @@ async def _(c, m):
                 ],
                 [
                     InlineKeyboardButton('📸 10', 'tg+10')
+                ],
+                [
+                    InlineKeyboardButton(f'🗂 {n} in one', f'tg+{n}+sheet') for n in Config.SHEET_SIZES
+                ],
+                [
+                    InlineKeyboardButton(f'✨ {n} smart', f'tg+{n}+smart') for n in Config.SMART_SIZES
+                ],
+                [
+                    InlineKeyboardButton('🎞 Clip', 'clip+tg+mp4'),
+                    InlineKeyboardButton('🖼 GIF', 'clip+tg+gif')
                 ]
             ]
         )
@@ -0,0 +1,17 @@
+from pyrogram import Client, Filters
+from bot import db
+from bot.utils import get_settings_markup, OUTPUT_SETTING_CHOICES
+
+
+@Client.on_callback_query(Filters.create(lambda _, query: query.data.startswith('output')))
+async def _(c, m):
+    _, field, value = m.data.split('+')
+    if field not in OUTPUT_SETTING_CHOICES:
+        return
+    if field != 'output_format':
+        value = int(value)
+    if value not in OUTPUT_SETTING_CHOICES[field]:
+        return
+    
+    await db.update_output_settings(m.from_user.id, **{field: value})
+    await m.edit_message_reply_markup(await get_settings_markup(m.from_user.id))
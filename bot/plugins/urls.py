@@ -2,7 +2,7 @@ import asyncio
 
 from pyrogram import Client, Filters, InlineKeyboardMarkup, InlineKeyboardButton
 
-from bot.utils import is_url, get_duration
+from bot.utils import is_url, get_probe, get_media_key, log_sink
 from config import Config
 
 
@@ -13,18 +13,14 @@ async def _(c, m):
     
     snt = await m.reply_text("Hi there, Please wait while I'm getting everything ready to process your request!", quote=True)
 
-    duration = await get_duration(m.text)
-    if duration is None:
+    info = await get_probe(get_media_key(m), m.text)
+    if info is None:
         await snt.edit_text("😟 Sorry! I cannot open the file.")
-        l = await m.forward(Config.LOG_CHANNEL)
-        await l.reply_text(f' Could not open the file.', True)
+        log_sink.report(f' Could not open the file.', m)
         return
     
-    hh, mm, ss = [int(i) for i in duration.split(":")]
-    seconds = hh*60*60 + mm*60 + ss
-    
     await snt.edit_text(
-        text=f"Hi, Choose the number of screenshots you need.\n\nTotal duration: `{duration}` (`{seconds}s`)",
+        text=f"Hi, Choose the number of screenshots you need.\n\nTotal duration: `{info['duration']}` (`{info['seconds']}s`)",
         reply_markup=InlineKeyboardMarkup(
             [
                 [
@@ -45,6 +41,16 @@ async def _(c, m):
                 ],
                 [
                     InlineKeyboardButton('📸 10', 'url+10')
+                ],
+                [
+                    InlineKeyboardButton(f'🗂 {n} in one', f'url+{n}+sheet') for n in Config.SHEET_SIZES
+                ],
+                [
+                    InlineKeyboardButton(f'✨ {n} smart', f'url+{n}+smart') for n in Config.SMART_SIZES
+                ],
+                [
+                    InlineKeyboardButton('🎞 Clip', 'clip+url+mp4'),
+                    InlineKeyboardButton('🖼 GIF', 'clip+url+gif')
                 ]
             ]
         )
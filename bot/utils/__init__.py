@@ -1 +1,10 @@
 from .utils import *
+from .extractor import *
+from .scheduler import *
+from .log_sink import log_sink
+from .progress import ProgressReporter
+from .metrics import metrics
+from .clipper import generate_clip
+from .uploader import Uploader
+from .results import get_result_key, send_cached_screenshots, save_screenshots
+from .screenshots import screenshot_job
@@ -0,0 +1,71 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+
+class TTLCache:
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+    async def get_or_create(self, key, factory):
+        value = self.get(key)
+        if value is not None:
+            return value
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._create(key, factory))
+            self._pending[key] = future
+        return await asyncio.shield(future)
+
+
+    async def _create(self, key, factory):
+        try:
+            value = await factory()
+            if value is not None:
+                self.set(key, value)
+            return value
+        finally:
+            self._pending.pop(key, None)
+
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+
+    def __len__(self):
+        return len(self._data)
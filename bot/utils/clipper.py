@@ -0,0 +1,62 @@
+import shlex
+
+from config import Config
+from .extractor import run_ffmpeg
+from .range_proxy import local_link
+from .metrics import metrics
+
+
+# codecs that can be copied into an mp4 container without re-encoding.
+STREAM_COPY_VIDEO = ('h264', 'hevc')
+STREAM_COPY_AUDIO = (None, 'aac', 'mp3')
+
+
+def can_stream_copy(info):
+    return info.get('video_codec') in STREAM_COPY_VIDEO and info.get('audio_codec') in STREAM_COPY_AUDIO
+
+
+def get_clip_args(copy):
+    if copy:
+        return "-map 0:v:0 -map 0:a:0? -c copy -avoid_negative_ts make_zero"
+    scale = f"scale=-2:'min(ih,{Config.CLIP_MAX_HEIGHT})'"
+    return (
+        f"-map 0:v:0 -map 0:a:0? -vf {shlex.quote(scale)} "
+        f"-c:v libx264 -preset veryfast -crf 23 -pix_fmt yuv420p -c:a aac -b:a 128k"
+    )
+
+
+def get_gif_filters():
+    return (
+        f"fps={Config.GIF_FPS},scale={Config.GIF_WIDTH}:-1:flags=lanczos,"
+        f"split[a][b];[a]palettegen[p];[b][p]paletteuse"
+    )
+
+
+async def _run_clip(cmd, output_file):
+    await run_ffmpeg(cmd)
+    if output_file.exists() and output_file.stat().st_size:
+        return output_file
+    return None
+
+
+async def generate_clip(file_link, start, duration, output_folder, info, output_format='mp4'):
+    # seeking on the input and limiting it with -t means ffmpeg only asks the
+    # server for the byte ranges it needs instead of reading the whole file.
+    file_link = await local_link(file_link)
+    input_args = f"-ss {start} -t {duration} -i {shlex.quote(file_link)}"
+    if output_format == 'gif':
+        output_file = output_folder.joinpath('clip.gif')
+        ffmpeg_cmd = f"ffmpeg {input_args} -filter_complex {shlex.quote(get_gif_filters())} -loop 0 -y {shlex.quote(str(output_file))}"
+        with metrics.timer('clip_seconds', 'Time to cut a clip or gif'):
+            return await _run_clip(ffmpeg_cmd, output_file)
+
+    output_file = output_folder.joinpath('clip.mp4')
+    with metrics.timer('clip_seconds', 'Time to cut a clip or gif'):
+        if can_stream_copy(info):
+            ffmpeg_cmd = f"ffmpeg {input_args} {get_clip_args(True)} -movflags +faststart -y {shlex.quote(str(output_file))}"
+            if await _run_clip(ffmpeg_cmd, output_file) is not None:
+                metrics.counter('clips_stream_copied_total', 'Clips cut without re-encoding').inc()
+                return output_file
+        ffmpeg_cmd = f"ffmpeg {input_args} {get_clip_args(False)} -movflags +faststart -y {shlex.quote(str(output_file))}"
+        metrics.counter('clips_transcoded_total', 'Clips that had to be re-encoded').inc()
+        return await _run_clip(ffmpeg_cmd, output_file)
@@ -0,0 +1,436 @@
+import io
+import os
+import re
+import shlex
+import math
+import shutil
+import asyncio
+import datetime
+import tempfile
+
+from config import Config
+from .utils import run_subprocess
+from .range_proxy import local_link
+from .cache import TTLCache
+from .metrics import metrics
+
+
+SCREENSHOT_MODES = ('parallel', 'multi', 'select')
+OUTPUT_FORMATS = dict(
+    png = ('png', 'png'),
+    jpeg = ('mjpeg', 'jpg'),
+    webp = ('libwebp', 'webp')
+)
+SMART_FRAME_SIZE = (32, 18)
+PNG_END = b'IEND\xaeB`\x82'
+JPEG_END = b'\xff\xd9'
+
+ffmpeg_semaphore = asyncio.Semaphore(Config.MAX_FFMPEG_PROCS)
+keyframe_cache = TTLCache(Config.PROBE_CACHE_SIZE, Config.PROBE_CACHE_TTL)
+ffmpeg_running = metrics.gauge('ffmpeg_running', 'ffmpeg processes currently running')
+
+metrics.register_cache('keyframe', keyframe_cache)
+
+
+def get_timestamps(seconds, num_screenshots):
+    reduced_sec = seconds - int(seconds*2 / 100)
+    return [int(reduced_sec/num_screenshots) * i for i in range(1, 1+num_screenshots)]
+
+
+def choose_mode(timestamps, mode=None):
+    mode = mode or Config.SCREENSHOT_MODE
+    if mode in SCREENSHOT_MODES:
+        return mode
+    # timestamps are evenly spaced, so the first one is also the gap between shots.
+    # When shots are close together decoding straight through is cheaper than seeking.
+    if timestamps[0] <= Config.SELECT_MAX_INTERVAL:
+        return 'select'
+    return 'parallel'
+
+
+def get_extension(settings=None):
+    output_format = (settings or {}).get('output_format', 'png')
+    return OUTPUT_FORMATS[output_format][1]
+
+
+def get_filters(settings=None):
+    max_dimension = (settings or {}).get('max_dimension')
+    if not max_dimension:
+        return []
+    return [f"scale='min(iw,{max_dimension})':'min(ih,{max_dimension})':force_original_aspect_ratio=decrease"]
+
+
+def get_codec_args(settings=None):
+    settings = settings or {}
+    output_format = settings.get('output_format', 'png')
+    quality = settings.get('quality', 85)
+    codec = OUTPUT_FORMATS[output_format][0]
+    if output_format == 'jpeg':
+        # mjpeg's qscale runs from 2 (best) to 31 (worst).
+        return f"-c:v {codec} -q:v {round(2 + (100 - quality) * 29 / 99)}"
+    if output_format == 'webp':
+        return f"-c:v {codec} -quality {quality}"
+    return f"-c:v {codec}"
+
+
+def get_output_args(settings=None, filters=None):
+    filters = (filters or []) + get_filters(settings)
+    args = f"-vf {shlex.quote(','.join(filters))} " if filters else ''
+    return args + get_codec_args(settings)
+
+
+def split_images(data, settings=None):
+    output_format = (settings or {}).get('output_format', 'png')
+    images = []
+    start = 0
+    while start < len(data):
+        if output_format == 'webp':
+            # RIFF header: 'RIFF', little endian payload size, then the payload.
+            end = start + 8 + int.from_bytes(data[start+4:start+8], 'little')
+        else:
+            marker = JPEG_END if output_format == 'jpeg' else PNG_END
+            end = data.find(marker, start)
+            if end == -1:
+                break
+            end += len(marker)
+        if end > len(data):
+            break
+        images.append(data[start:end])
+        start = end
+    return images
+
+
+def frame_to_media(i, data, output_folder, settings=None):
+    name = f'{i}.{get_extension(settings)}'
+    if Config.IN_MEMORY_UPLOADS:
+        media = io.BytesIO(data)
+        media.name = name
+        return media
+    media = output_folder.joinpath(name)
+    media.write_bytes(data)
+    return str(media)
+
+
+async def run_ffmpeg(cmd, timeout=None):
+    async with ffmpeg_semaphore:
+        ffmpeg_running.inc()
+        try:
+            return await run_subprocess(cmd, timeout)
+        finally:
+            ffmpeg_running.dec()
+
+
+def get_seek_args(seek_mode):
+    if seek_mode == 'fast':
+        return "-skip_frame nokey -noaccurate_seek "
+    return ""
+
+
+async def sample_keyframes(file_link, timestamps):
+    known = keyframe_cache.get(file_link) or {}
+    missing = [sec for sec in timestamps if sec not in known]
+    if missing:
+        # a seek lands on the keyframe at or before the target, so reading one
+        # packet after each seek yields exactly the keyframes we would decode.
+        intervals = ','.join(f'{sec}%+#1' for sec in missing)
+        ffprobe_cmd = (
+            f"ffprobe -v error -select_streams v:0 -read_intervals {intervals} "
+            f"-show_entries packet=pts_time,flags -of csv=p=0 {shlex.quote(file_link)}"
+        )
+        with metrics.timer('keyframe_probe_seconds', 'Time to sample keyframes for fast seeking'):
+            output = await run_ffmpeg(ffprobe_cmd, Config.PROBE_TIMEOUT)
+        keyframes = []
+        for line in output[0].decode(errors='replace').splitlines():
+            pts_time, _, flags = line.partition(',')
+            if 'K' in flags and pts_time not in ('', 'N/A'):
+                keyframes.append(float(pts_time))
+        keyframes.sort()
+        for sec in missing:
+            earlier = [keyframe for keyframe in keyframes if keyframe <= sec]
+            known[sec] = earlier[-1] if earlier else sec
+        keyframe_cache.set(file_link, known)
+    return [known[sec] for sec in timestamps]
+
+
+async def snap_to_keyframes(file_link, timestamps):
+    snapped = []
+    for sec in await sample_keyframes(file_link, timestamps):
+        if sec not in snapped:
+            snapped.append(sec)
+    return snapped
+
+
+async def extract_frame(file_link, sec, settings=None, seek_mode=None):
+    ffmpeg_cmd = (
+        f"ffmpeg {get_seek_args(seek_mode)}-ss {sec} -i {shlex.quote(file_link)} "
+        f"-vframes 1 {get_output_args(settings)} -f image2pipe pipe:1"
+    )
+    with metrics.timer('ffmpeg_seek_seconds', 'Time to seek, decode and encode one frame'):
+        output = await run_ffmpeg(ffmpeg_cmd)
+    return output[0] or None
+
+
+async def _extract_parallel(file_link, timestamps, progress, fanout, settings, seek_mode, on_frame=None):
+    request_semaphore = asyncio.Semaphore(fanout)
+    generated = 0
+
+    async def _extract(i, sec):
+        nonlocal generated
+        async with request_semaphore:
+            data = await extract_frame(file_link, sec, settings, seek_mode)
+        generated += 1
+        if progress is not None:
+            await progress(generated, len(timestamps))
+        if on_frame is not None:
+            # failures are passed on too, so consumers waiting on order can skip them.
+            await on_frame(i, sec, data or None)
+        return (sec, data) if data else None
+
+    tasks = [asyncio.ensure_future(_extract(i, sec)) for i, sec in enumerate(timestamps)]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        # once one frame fails, e.g. because the upload stage died, the rest
+        # must not keep running ffmpeg outside the job's slot.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    for task in done:
+        if not task.cancelled() and task.exception() is not None:
+            raise task.exception()
+    results = [task.result() for task in tasks]
+    return [result for result in results if result is not None]
+
+
+async def _extract_multi(file_link, timestamps, settings, seek_mode):
+    os.makedirs(Config.SCRST_OP_FLDR, exist_ok=True)
+    output_folder = tempfile.mkdtemp(dir=Config.SCRST_OP_FLDR)
+    extension = get_extension(settings)
+    output_args = get_output_args(settings)
+    try:
+        inputs = ' '.join(f"{get_seek_args(seek_mode)}-ss {sec} -i {shlex.quote(file_link)}" for sec in timestamps)
+        outputs = ' '.join(
+            f"-map {i}:v:0 -vframes 1 {output_args} '{os.path.join(output_folder, f'{i}.{extension}')}'"
+            for i in range(len(timestamps))
+        )
+        with metrics.timer('ffmpeg_batch_seconds', 'Time to extract all frames of a job in one ffmpeg process'):
+            await run_ffmpeg(f"ffmpeg {inputs} {outputs}")
+        results = []
+        for i, sec in enumerate(timestamps):
+            output = os.path.join(output_folder, f'{i}.{extension}')
+            if os.path.exists(output):
+                with open(output, 'rb') as f:
+                    results.append((sec, f.read()))
+        return results
+    finally:
+        shutil.rmtree(output_folder, ignore_errors=True)
+
+
+async def _extract_select(file_link, timestamps, settings, seek_mode):
+    interval = timestamps[1] - timestamps[0] if len(timestamps) > 1 else 0
+    select = f"select='isnan(prev_selected_t)+gte(t-prev_selected_t,{interval})'"
+    # no fast seeking here: skipping non-keyframes would make select pick
+    # keyframes that no longer match the timestamps the frames are paired with.
+    ffmpeg_cmd = (
+        f"ffmpeg -ss {timestamps[0]} -i {shlex.quote(file_link)} {get_output_args(settings, [select])} -vsync 0 "
+        f"-vframes {len(timestamps)} -f image2pipe pipe:1"
+    )
+    with metrics.timer('ffmpeg_batch_seconds', 'Time to extract all frames of a job in one ffmpeg process'):
+        output = await run_ffmpeg(ffmpeg_cmd)
+    return list(zip(timestamps, split_images(output[0], settings)))
+
+
+async def sample_thumbnail(file_link, sec):
+    width, height = SMART_FRAME_SIZE
+    # keyframes only and a small probe keep every sample to roughly one GOP of reads.
+    ffmpeg_cmd = (
+        f"ffmpeg -probesize {Config.SMART_PROBESIZE} {get_seek_args('fast')}-ss {sec} -i {shlex.quote(file_link)} "
+        f"-vframes 1 -vf showinfo,scale={width}:{height},format=gray -f rawvideo pipe:1"
+    )
+    output = await run_ffmpeg(ffmpeg_cmd)
+    if len(output[0]) != width * height:
+        return None
+    # the keyframe decoded sits at or before sec, and its pts is relative to
+    # sec. Returning its real time makes the job extract this very frame
+    # whatever the seek mode.
+    pts_time = re.search(r"pts_time:(-?[\d.]+)", output[1].decode(errors='replace'))
+    if pts_time is None:
+        return None
+    return max(0, math.floor((sec + float(pts_time.group(1))) * 1000) / 1000), output[0]
+
+
+def is_blank(pixels):
+    mean = sum(pixels) / len(pixels)
+    spread = sum(abs(pixel - mean) for pixel in pixels) / len(pixels)
+    # black frames and the flat frames of fades carry next to no detail.
+    return mean < Config.SMART_BLACK_LEVEL or spread < Config.SMART_BLACK_LEVEL / 3
+
+
+def frame_distance(a, b):
+    return sum(abs(x - y) for x, y in zip(a, b)) / len(a)
+
+
+def get_detail(sample):
+    return len(set(sample[1]))
+
+
+def pick_distinct(samples, count):
+    blank = [sample for sample in samples if is_blank(sample[1])]
+    candidates = [sample for sample in samples if not is_blank(sample[1])] or blank
+    # start from the frame with the most detail, then keep adding the frame
+    # farthest from everything picked so far.
+    picked = [max(candidates, key=get_detail)]
+    candidates = [sample for sample in candidates if sample is not picked[0]]
+    distances = {sample[0]: frame_distance(sample[1], picked[0][1]) for sample in candidates}
+    while candidates and len(picked) < count:
+        best = max(candidates, key=lambda sample: distances[sample[0]])
+        picked.append(best)
+        candidates.remove(best)
+        for sample in candidates:
+            distances[sample[0]] = min(distances[sample[0]], frame_distance(sample[1], best[1]))
+    # too few frames with content; blank ones still beat returning fewer shots.
+    for sample in sorted(blank, key=get_detail, reverse=True):
+        if len(picked) >= count:
+            break
+        if sample not in picked:
+            picked.append(sample)
+    return sorted(sec for sec, _ in picked)
+
+
+async def select_smart_timestamps(file_link, timestamps, fanout=Config.SCREENSHOT_FANOUT):
+    # timestamps are the evenly spaced ones of the job, samples are taken
+    # SMART_OVERSAMPLE times as densely over the same span.
+    count = len(timestamps)
+    step = timestamps[0] / Config.SMART_OVERSAMPLE
+    request_semaphore = asyncio.Semaphore(fanout)
+
+    async def _sample(sec):
+        async with request_semaphore:
+            return await sample_thumbnail(file_link, sec)
+
+    tasks = [asyncio.ensure_future(_sample(round(step * i, 3))) for i in range(1, 1 + count * Config.SMART_OVERSAMPLE)]
+    with metrics.timer('smart_select_seconds', 'Time to sample frames for smart screenshots'):
+        done, pending = await asyncio.wait(tasks, timeout=Config.SMART_TIMEOUT)
+        for task in pending:
+            task.cancel()
+    # nearby samples in a long GOP can decode the same keyframe.
+    samples = dict(task.result() for task in done if not task.cancelled() and task.exception() is None and task.result())
+    if len(samples) < count:
+        # too little came back within the deadline to improve on even spacing.
+        metrics.counter('smart_select_fallbacks_total', 'Smart selections that fell back to evenly spaced timestamps').inc()
+        return timestamps
+    return pick_distinct(sorted(samples.items()), count)
+
+
+def get_sheet_grid(count, columns=None):
+    columns = columns or Config.SHEET_COLUMNS or math.ceil(math.sqrt(count))
+    return columns, math.ceil(count / columns)
+
+
+def get_timestamp_label(text):
+    return (
+        f"drawtext=text='{text}':x=8:y=h-th-8:fontsize=h/12:fontcolor=white:"
+        f"box=1:boxcolor=black@0.6:boxborderw=4"
+    )
+
+
+def get_sheet_command(file_link, timestamps, settings=None, seek_mode=None, columns=None, labels=True, mode=None):
+    columns, rows = get_sheet_grid(len(timestamps), columns)
+    tile = f"tile={columns}x{rows}:padding=4:margin=4"
+    scale = f"scale={Config.SHEET_TILE_WIDTH}:-2"
+    output_filters = get_filters(settings)
+    if choose_mode(timestamps, mode) == 'select':
+        # one input decoded straight through; -copyts keeps the source
+        # timestamps so they can be printed on each tile.
+        interval = timestamps[1] - timestamps[0] if len(timestamps) > 1 else 0
+        select = f"select='isnan(prev_selected_t)+gte(t-prev_selected_t,{interval})'"
+        filters = [select, scale] + ([get_timestamp_label('%{pts\\:hms}')] if labels else []) + [tile] + output_filters
+        ffmpeg_cmd = (
+            f"ffmpeg -ss {timestamps[0]} -copyts -i {shlex.quote(file_link)} "
+            f"-vf {shlex.quote(','.join(filters))} -vframes 1 {get_codec_args(settings)} -f image2pipe pipe:1"
+        )
+    else:
+        # one seeked input per tile, joined in a single filter graph.
+        inputs = ' '.join(f"{get_seek_args(seek_mode)}-ss {sec} -i {shlex.quote(file_link)}" for sec in timestamps)
+        labelled = ';'.join(
+            f"[{i}:v:0]trim=end_frame=1,setpts=PTS-STARTPTS,{scale}"
+            + (f",{get_timestamp_label(str(datetime.timedelta(seconds=int(sec))).replace(':', chr(92) + ':'))}" if labels else '')
+            + f"[v{i}]"
+            for i, sec in enumerate(timestamps)
+        )
+        joined = ''.join(f"[v{i}]" for i in range(len(timestamps)))
+        graph = f"{labelled};{joined}concat=n={len(timestamps)}:v=1:a=0,{','.join([tile] + output_filters)}[sheet]"
+        ffmpeg_cmd = (
+            f"ffmpeg {inputs} -filter_complex {shlex.quote(graph)} -map '[sheet]' -vframes 1 "
+            f"{get_codec_args(settings)} -f image2pipe pipe:1"
+        )
+    return ffmpeg_cmd
+
+
+async def extract_contact_sheet(file_link, timestamps, settings=None, seek_mode=None, columns=None):
+    # drawtext only exists in ffmpeg builds with libfreetype and needs a font,
+    # so a sheet that fails over its labels is tried once more without them.
+    mode = choose_mode(timestamps)
+    if seek_mode == 'fast' and mode != 'select':
+        # a fast seek shows the keyframe before each timestamp, label the tile with it.
+        timestamps = await snap_to_keyframes(file_link, timestamps)
+    for labels in ([True, False] if Config.SHEET_LABELS else [False]):
+        ffmpeg_cmd = get_sheet_command(file_link, timestamps, settings, seek_mode, columns, labels, mode)
+        with metrics.timer('ffmpeg_batch_seconds', 'Time to extract all frames of a job in one ffmpeg process'):
+            output = await run_ffmpeg(ffmpeg_cmd)
+        if output[0]:
+            return output[0]
+        if not labels or not re.search(r"drawtext|font", output[1].decode(errors='replace'), re.I):
+            break
+        metrics.counter('sheet_label_fallbacks_total', 'Contact sheets retried without timestamp labels').inc()
+    return None
+
+
+async def deliver_frames(frames, on_frame=None):
+    if on_frame is not None:
+        for i, (sec, data) in enumerate(frames):
+            await on_frame(i, sec, data)
+    return frames
+
+
+async def extract_screenshots(file_link, timestamps, progress=None, mode=None, settings=None, seek_mode=None, layout=None, on_frame=None, fanout=Config.SCREENSHOT_FANOUT):
+    seek_mode = seek_mode or Config.SEEK_MODE
+    # every ffmpeg call of the job reads through the proxy, so the header and
+    # index are fetched from upstream once and shared.
+    file_link = await local_link(file_link)
+    if layout == 'sheet':
+        data = await extract_contact_sheet(file_link, timestamps, settings, seek_mode)
+        results = [(timestamps[0], data)] if data else []
+        if progress is not None:
+            await progress(len(timestamps) if data else 0, len(timestamps))
+        return await deliver_frames(results, on_frame)
+
+    if layout == 'smart':
+        # sampled wherever the job runs, so worker backends take this load
+        # off the bot too.
+        if choose_mode(timestamps, mode) == 'select':
+            # select expects evenly spaced timestamps, smart ones are not.
+            mode = 'parallel'
+        timestamps = await select_smart_timestamps(file_link, timestamps, fanout)
+    mode = choose_mode(timestamps, mode)
+    if seek_mode == 'fast' and mode != 'select':
+        timestamps = await snap_to_keyframes(file_link, timestamps)
+    if mode == 'parallel':
+        return await _extract_parallel(file_link, timestamps, progress, fanout, settings, seek_mode, on_frame)
+
+    if mode == 'multi':
+        results = await _extract_multi(file_link, timestamps, settings, seek_mode)
+    else:
+        results = await _extract_select(file_link, timestamps, settings, seek_mode)
+    if len(results) < len(timestamps):
+        # a batch that timed out or died part way through only costs the
+        # frames it missed, those are seeked one by one instead.
+        metrics.counter('batch_fallbacks_total', 'Batch extractions completed frame by frame').inc()
+        extracted = {sec for sec, _ in results}
+        missing = [sec for sec in timestamps if sec not in extracted]
+        # select never fast seeks, its frames would not match the timestamps.
+        results += await _extract_parallel(file_link, missing, None, fanout, settings, seek_mode if mode == 'multi' else 'accurate')
+        results.sort(key=lambda result: result[0])
+    if progress is not None:
+        await progress(len(results), len(timestamps))
+    return await deliver_frames(results, on_frame)
@@ -0,0 +1,175 @@
+import html
+import asyncio
+import traceback
+
+from pyrogram.errors import FloodWait, InternalServerError
+
+from config import Config
+from .metrics import metrics
+
+
+PRIORITY_ERROR = 0
+PRIORITY_NEW_USER = 1
+MAX_MESSAGE_LENGTH = 4000
+MAX_ENTRY_LENGTH = 1500
+# errors worth trying again later; anything else is about the entry itself.
+TRANSIENT_ERRORS = (FloodWait, InternalServerError, OSError, asyncio.TimeoutError)
+
+
+class LogSink:
+
+    def __init__(self, maxsize, interval):
+        self.maxsize = maxsize
+        self.interval = interval
+        self.dropped = 0
+        self.client = None
+        self._entries = []
+        self._task = None
+
+
+    def start(self, client):
+        self.client = client
+        self._task = asyncio.ensure_future(self._run())
+
+
+    def report(self, text, message=None, priority=PRIORITY_ERROR):
+        if len(self._entries) >= self.maxsize:
+            # drop the newest entry of the least important kind, which may be
+            # the incoming one.
+            worst = max(range(len(self._entries)), key=lambda i: (self._entries[i]['priority'], i))
+            self.dropped += 1
+            metrics.counter('log_entries_dropped_total', 'Log channel entries dropped on overflow').inc()
+            if self._entries[worst]['priority'] < priority:
+                return
+            del self._entries[worst]
+        self._entries.append(dict(priority=priority, text=text, message=message, link=None))
+
+
+    def new_user(self, from_user):
+        self.report(
+            f'<a href="tg://user?id={from_user.id}">{html.escape(from_user.first_name or str(from_user.id))}</a>',
+            priority=PRIORITY_NEW_USER
+        )
+
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except FloodWait as e:
+                metrics.counter('floodwait_total', 'FloodWait errors received').inc()
+                await asyncio.sleep(e.x)
+            except Exception:
+                traceback.print_exc()
+
+
+    async def flush(self):
+        entries, self._entries = self._entries, []
+        try:
+            await self._forward(entries)
+            await self._send(entries)
+        except (asyncio.CancelledError, *TRANSIENT_ERRORS):
+            # keep whatever was not delivered for the next round; forwarded
+            # messages already have their link so they are not forwarded twice.
+            self._entries = [entry for entry in entries if not entry.get('sent')] + self._entries
+            raise
+        except Exception:
+            # never put back what failed for a reason of its own, or it would
+            # block every later flush the same way.
+            self._drop([entry for entry in entries if not entry.get('sent')])
+            raise
+
+
+    def _drop(self, entries):
+        for entry in entries:
+            entry['sent'] = True
+        if entries:
+            metrics.counter('log_entries_failed_total', 'Log channel entries dropped after a permanent error').inc(len(entries))
+
+
+    async def _forward(self, entries):
+        chats = {}
+        for entry in entries:
+            if entry['message'] is not None and entry['link'] is None:
+                chats.setdefault(entry['message'].chat.id, []).append(entry)
+        for chat_id, chat_entries in chats.items():
+            try:
+                await self._forward_batch(chat_id, chat_entries)
+            except TRANSIENT_ERRORS:
+                raise
+            except Exception:
+                # e.g. one of the files was deleted meanwhile; retry one by one
+                # and report the ones that still fail without their file.
+                for entry in chat_entries:
+                    try:
+                        await self._forward_batch(chat_id, [entry])
+                    except TRANSIENT_ERRORS:
+                        raise
+                    except Exception:
+                        traceback.print_exc()
+                        entry['message'] = None
+
+
+    async def _forward_batch(self, chat_id, entries):
+        message_ids = [entry['message'].message_id for entry in entries]
+        forwarded = await self.client.forward_messages(Config.LOG_CHANNEL, chat_id, message_ids)
+        if not isinstance(forwarded, list):
+            forwarded = [forwarded]
+        for entry, message in zip(entries, forwarded):
+            entry['link'] = f"https://t.me/c/{str(Config.LOG_CHANNEL)[4:]}/{message.message_id}"
+
+
+    async def _send(self, entries):
+        new_users = [entry for entry in entries if entry['priority'] == PRIORITY_NEW_USER]
+        errors = [entry for entry in entries if entry['priority'] == PRIORITY_ERROR]
+        blocks = []
+        if new_users:
+            blocks.append((new_users, f"<b>New users ({len(new_users)}):</b> " + ', '.join(entry['text'] for entry in new_users)))
+        for entry in errors:
+            text = entry['text']
+            if len(text) > MAX_ENTRY_LENGTH:
+                text = text[:MAX_ENTRY_LENGTH//3] + '\n…\n' + text[-MAX_ENTRY_LENGTH*2//3:]
+            text = html.escape(text)
+            if entry['link']:
+                text = f'<a href="{entry["link"]}">file</a>\n{text}'
+            blocks.append(([entry], text))
+        if self.dropped:
+            blocks.append(([], f"<i>{self.dropped} log entries dropped.</i>"))
+            self.dropped = 0
+
+        while blocks:
+            chunk = []
+            length = 0
+            while blocks and (not chunk or length + len(blocks[0][1]) < MAX_MESSAGE_LENGTH):
+                chunk.append(blocks.pop(0))
+                length += len(chunk[-1][1]) + 2
+            try:
+                await self._send_chunk(chunk)
+            except TRANSIENT_ERRORS:
+                raise
+            except Exception:
+                # find the block the channel refuses and drop only that one.
+                for block in chunk:
+                    try:
+                        await self._send_chunk([block])
+                    except TRANSIENT_ERRORS:
+                        raise
+                    except Exception:
+                        traceback.print_exc()
+                        self._drop(block[0])
+
+
+    async def _send_chunk(self, chunk):
+        await self.client.send_message(
+            Config.LOG_CHANNEL,
+            '\n\n'.join(text[:MAX_MESSAGE_LENGTH] for _, text in chunk),
+            parse_mode='html',
+            disable_web_page_preview=True
+        )
+        for chunk_entries, _ in chunk:
+            for entry in chunk_entries:
+                entry['sent'] = True
+
+
+log_sink = LogSink(Config.LOG_QUEUE_SIZE, Config.LOG_FLUSH_INTERVAL)
@@ -0,0 +1,203 @@
+import time
+import asyncio
+import bisect
+from collections import deque
+from contextlib import contextmanager
+
+
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Counter:
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+
+    def __init__(self, name, help, fn=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self._value = 0
+
+
+    @property
+    def value(self):
+        return self.fn() if self.fn is not None else self._value
+
+
+    def set(self, value):
+        self._value = value
+
+
+    def inc(self, amount=1):
+        self._value += amount
+
+
+    def dec(self, amount=1):
+        self._value -= amount
+
+
+class Histogram:
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS, window=1000):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+        self._recent = deque(maxlen=window)
+
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self._recent.append(value)
+
+
+    def reset(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+        self._recent.clear()
+
+
+    def percentile(self, q):
+        if not self._recent:
+            return None
+        recent = sorted(self._recent)
+        return recent[min(len(recent) - 1, int(q * len(recent)))]
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._caches = {}
+
+
+    def _get(self, cls, name, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        return metric
+
+
+    def counter(self, name, help=''):
+        return self._get(Counter, name, help)
+
+
+    def gauge(self, name, help='', fn=None):
+        return self._get(Gauge, name, help, fn)
+
+
+    def histogram(self, name, help='', **kwargs):
+        return self._get(Histogram, name, help, **kwargs)
+
+
+    def histograms(self):
+        return [metric for metric in self._metrics.values() if isinstance(metric, Histogram)]
+
+
+    def reset(self):
+        for metric in self._metrics.values():
+            if isinstance(metric, Histogram):
+                metric.reset()
+            elif isinstance(metric, Counter):
+                metric.value = 0
+        for cache in self._caches.values():
+            cache.hits = cache.misses = 0
+
+
+    def register_cache(self, name, cache):
+        self._caches[name] = cache
+
+
+    @contextmanager
+    def timer(self, name, help=''):
+        histogram = self.histogram(name, help)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            histogram.observe(time.monotonic() - start)
+
+
+    def render_text(self):
+        lines = []
+        for metric in self._metrics.values():
+            if isinstance(metric, Histogram):
+                if not metric.count:
+                    continue
+                p50, p95, p99 = (metric.percentile(q) for q in (0.5, 0.95, 0.99))
+                lines.append(
+                    f"{metric.name}: n={metric.count} avg={metric.sum/metric.count:.2f}s "
+                    f"p50={p50:.2f}s p95={p95:.2f}s p99={p99:.2f}s"
+                )
+            else:
+                lines.append(f"{metric.name}: {metric.value}")
+        for name, cache in self._caches.items():
+            lookups = cache.hits + cache.misses
+            hit_rate = cache.hits / lookups * 100 if lookups else 0
+            lines.append(f"{name}_cache: {len(cache)} entries, {hit_rate:.1f}% hits of {lookups}")
+        return '\n'.join(lines)
+
+
+    def render_prometheus(self):
+        lines = []
+        for metric in self._metrics.values():
+            name = f"screenshot_bot_{metric.name}"
+            lines.append(f"# HELP {name} {metric.help or metric.name}")
+            if isinstance(metric, Histogram):
+                lines.append(f"# TYPE {name} histogram")
+                cumulative = 0
+                for bound, count in zip(metric.buckets, metric.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{le="+Inf"}} {metric.count}')
+                lines.append(f"{name}_sum {metric.sum}")
+                lines.append(f"{name}_count {metric.count}")
+            else:
+                lines.append(f"# TYPE {name} {'counter' if isinstance(metric, Counter) else 'gauge'}")
+                lines.append(f"{name} {metric.value}")
+        for cache_name, cache in self._caches.items():
+            for result in ('hits', 'misses'):
+                name = f"screenshot_bot_{cache_name}_cache_{result}_total"
+                lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name} {getattr(cache, result)}")
+        return '\n'.join(lines) + '\n'
+
+
+    async def serve(self, port, host='0.0.0.0'):
+
+        async def _handle(reader, writer):
+            try:
+                await reader.readuntil(b'\r\n\r\n')
+                body = self.render_prometheus().encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: text/plain; version=0.0.4\r\n"
+                    + f"Content-Length: {len(body)}\r\n".encode()
+                    + b"Connection: close\r\n\r\n"
+                    + body
+                )
+                await writer.drain()
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(_handle, host, port)
+
+
+metrics = Registry()
@@ -0,0 +1,57 @@
+import asyncio
+
+from config import Config
+from .utils import edit_message_text
+
+
+class ProgressReporter:
+
+    def __init__(self, m, interval=Config.PROGRESS_INTERVAL, reply_markup=None):
+        self.m = m
+        self.interval = interval
+        self.reply_markup = reply_markup
+        self._text = None
+        self._sent = None
+        self._changed = asyncio.Event()
+        self._finished = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+
+    def update(self, text):
+        if self._finished.is_set():
+            return
+        self._text = text
+        self._changed.set()
+
+
+    def finish(self, text):
+        self.update(text)
+        # the final state never keeps buttons that only made sense while running.
+        self.reply_markup = None
+        self._finished.set()
+
+
+    def cancel(self):
+        self._task.cancel()
+
+
+    async def wait_closed(self):
+        await self._task
+
+
+    async def _run(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            if self._text != self._sent:
+                text = self._text
+                await edit_message_text(self.m, text=text, reply_markup=self.reply_markup)
+                self._sent = text
+            if self._finished.is_set() and self._text == self._sent:
+                return
+            # updates that arrive meanwhile are coalesced into the next edit;
+            # finishing cuts the wait short so the final state goes out at once.
+            try:
+                await asyncio.wait_for(self._finished.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,336 @@
+import os
+import ssl
+import asyncio
+import hashlib
+import threading
+import traceback
+import http.client
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urljoin, quote, unquote
+
+from config import Config
+from .cache import TTLCache
+from .metrics import metrics
+
+
+REDIRECTS = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+# streaming playlists point ffmpeg at further URIs relative to their own, so
+# they are handed over untouched.
+PLAYLIST_EXTENSIONS = ('.m3u8', '.m3u', '.mpd', '.ism', '.f4m')
+PLAYLIST_TYPES = (
+    'application/vnd.apple.mpegurl',
+    'application/x-mpegurl',
+    'audio/mpegurl',
+    'audio/x-mpegurl',
+    'application/dash+xml',
+    'application/f4m+xml'
+)
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class BlockCache:
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._blocks = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key):
+        data = self._blocks.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self._blocks.move_to_end(key)
+        self.hits += 1
+        return data
+
+
+    def set(self, key, data):
+        old = self._blocks.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self._blocks[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes and self._blocks:
+            _, evicted = self._blocks.popitem(last=False)
+            self.size -= len(evicted)
+
+
+    def __contains__(self, key):
+        return key in self._blocks
+
+
+    def __len__(self):
+        return len(self._blocks)
+
+
+class UpstreamPool:
+
+    def __init__(self, timeout, max_idle, user_agent, tls_verify):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.user_agent = user_agent
+        # ffmpeg does not verify certificates by default; match it so every
+        # source it could open directly still opens through the proxy.
+        self.ssl_context = ssl.create_default_context() if tls_verify else ssl._create_unverified_context()
+        self._idle = {}
+        self._lock = threading.Lock()
+
+
+    def _acquire(self, parts):
+        with self._lock:
+            idle = self._idle.get((parts.scheme, parts.netloc))
+            if idle:
+                return idle.pop()
+        if parts.scheme == 'https':
+            return http.client.HTTPSConnection(parts.netloc, timeout=self.timeout, context=self.ssl_context)
+        return http.client.HTTPConnection(parts.netloc, timeout=self.timeout)
+
+
+    def _release(self, parts, conn):
+        with self._lock:
+            idle = self._idle.setdefault((parts.scheme, parts.netloc), [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+
+    def get_range(self, url, start, end):
+        # blocking, runs on the proxy's executor. Returns the status, the
+        # response headers and the body; the body is only read for 206s so a
+        # server that ignores Range never streams us the whole file.
+        parts = urlsplit(url)
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        for attempt in range(2):
+            conn = self._acquire(parts)
+            try:
+                conn.request('GET', path, headers={'Range': f'bytes={start}-{end}', 'User-Agent': self.user_agent})
+                response = conn.getresponse()
+                body = response.read() if response.status == 206 else b''
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                # an idle keep-alive connection may have been closed by the server.
+                if attempt:
+                    raise
+                continue
+            if response.status != 206 or response.will_close:
+                conn.close()
+            else:
+                self._release(parts, conn)
+            return response.status, response.headers, body
+
+
+class RangeProxy:
+
+    def __init__(self, max_bytes, block_size, readahead=0, connections=8, timeout=30, user_agent=None, tls_verify=False):
+        self.block_size = block_size
+        self.readahead = readahead
+        self.cache = BlockCache(max_bytes)
+        self.upstream = UpstreamPool(timeout, connections, user_agent, tls_verify)
+        self.port = None
+        self._sources = TTLCache(Config.STREAM_LINK_CACHE_SIZE, Config.STREAM_LINK_TTL)
+        self._pending = {}
+        self._executor = ThreadPoolExecutor(connections)
+        self._server = None
+
+
+    async def start(self, host='127.0.0.1'):
+        if self._server is None:
+            self._server = asyncio.ensure_future(asyncio.start_server(self._handle, host, 0))
+        server = await asyncio.shield(self._server)
+        self.port = server.sockets[0].getsockname()[1]
+        return server
+
+
+    async def local_link(self, url):
+        if not url.startswith(('http://', 'https://')):
+            return url
+        path = urlsplit(url).path
+        if path.lower().endswith(PLAYLIST_EXTENSIONS):
+            return url
+        await self.start()
+        source_id = hashlib.sha1(url.encode()).hexdigest()[:16]
+        # keep the original file name, ffmpeg uses the extension as a format hint.
+        name = os.path.basename(path) or 'stream'
+        if self._sources.get(source_id) is None:
+            self._sources.set(source_id, dict(url=url, name=name, size=None, content_type=None, direct=False))
+        return f"http://127.0.0.1:{self.port}/{source_id}/{quote(name)}"
+
+
+    async def _fetch(self, source, index):
+        start = index * self.block_size
+        end = start + self.block_size - 1
+        if source['size'] is not None:
+            end = min(end, source['size'] - 1)
+        loop = asyncio.get_event_loop()
+        for _ in range(MAX_REDIRECTS):
+            status, headers, body = await loop.run_in_executor(self._executor, self.upstream.get_range, source['url'], start, end)
+            if status in REDIRECTS and headers.get('Location'):
+                source['url'] = urljoin(source['url'], headers['Location'])
+                continue
+            break
+        if status == 416:
+            return b''
+        if status == 200:
+            raise RangeNotSupported(source['url'])
+        if status != 206:
+            raise UpstreamError(f'{status} from {source["url"]}')
+        source['content_type'] = (headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        total = headers.get('Content-Range', '').rpartition('/')[2]
+        if total.isdigit():
+            source['size'] = int(total)
+        metrics.counter('proxy_upstream_bytes_total', 'Bytes the range proxy read from upstream').inc(len(body))
+        return body
+
+
+    async def get_block(self, source_id, source, index):
+        key = (source_id, index)
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+        future = self._pending.get(key)
+        if future is None:
+            future = self._pending[key] = asyncio.ensure_future(self._fetch(source, index))
+            future.add_done_callback(lambda future: self._fetched(key, future))
+        # a reader going away must not cancel a fetch other readers share.
+        return await asyncio.shield(future)
+
+
+    def _fetched(self, key, future):
+        self._pending.pop(key, None)
+        if not future.cancelled() and future.exception() is None and future.result():
+            self.cache.set(key, future.result())
+
+
+    def _read_ahead(self, source_id, source, index):
+        last = (source['size'] - 1) // self.block_size
+        for ahead in range(index + 1, min(index + 1 + self.readahead, last + 1)):
+            if (source_id, ahead) not in self.cache and (source_id, ahead) not in self._pending:
+                future = self._pending[(source_id, ahead)] = asyncio.ensure_future(self._fetch(source, ahead))
+                future.add_done_callback(lambda future, key=(source_id, ahead): self._fetched(key, future))
+
+
+    @staticmethod
+    def _parse_range(value, size):
+        if not value or not value.startswith('bytes='):
+            return None
+        first, _, last = value[6:].split(',')[0].strip().partition('-')
+        if not first:
+            return max(0, size - int(last)), size - 1
+        return int(first), min(int(last), size - 1) if last else size - 1
+
+
+    async def _redirect(self, writer, url):
+        metrics.counter('proxy_redirects_total', 'Requests the range proxy sent straight to upstream').inc()
+        await self._respond(writer, 302, 'Found', {'Location': url, 'Content-Length': 0, 'Connection': 'close'})
+
+
+    @staticmethod
+    async def _respond(writer, status, reason, headers):
+        head = [f"HTTP/1.1 {status} {reason}"] + [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+
+
+    async def _handle(self, reader, writer):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+            request_line, *lines = head.decode('latin-1').split('\r\n')
+            method, path, _ = request_line.split(' ', 2)
+            request_headers = {name.strip().lower(): value.strip() for name, _, value in (line.partition(':') for line in lines if line)}
+
+            source_id, _, rest = path.lstrip('/').partition('/')
+            source = self._sources.get(source_id)
+            if source is None:
+                await self._respond(writer, 404, 'Not Found', {'Content-Length': 0, 'Connection': 'close'})
+                return
+            if unquote(rest.split('?')[0]) != source['name']:
+                # a URI the source refers to relative to itself; send ffmpeg to
+                # where it would have gone without the proxy.
+                await self._redirect(writer, urljoin(source['url'], rest))
+                return
+            if source['size'] is None and not source['direct']:
+                try:
+                    await self.get_block(source_id, source, 0)
+                except (RangeNotSupported, UpstreamError, http.client.HTTPException, OSError):
+                    # whatever the proxy cannot read, ffmpeg may still open on its own.
+                    traceback.print_exc()
+                    source['direct'] = True
+            if source['content_type'] in PLAYLIST_TYPES:
+                source['direct'] = True
+            if source['direct'] or source['size'] is None:
+                await self._redirect(writer, source['url'])
+                return
+
+            size = source['size']
+            byte_range = self._parse_range(request_headers.get('range'), size)
+            start, end = byte_range or (0, size - 1)
+            if start >= size:
+                await self._respond(writer, 416, 'Range Not Satisfiable', {'Content-Range': f'bytes */{size}', 'Content-Length': 0, 'Connection': 'close'})
+                return
+            headers = {
+                'Accept-Ranges': 'bytes',
+                'Content-Type': 'application/octet-stream',
+                'Content-Length': end - start + 1,
+                'Connection': 'close'
+            }
+            if byte_range:
+                headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+                await self._respond(writer, 206, 'Partial Content', headers)
+            else:
+                await self._respond(writer, 200, 'OK', headers)
+            if method == 'HEAD':
+                return
+
+            position = start
+            while position <= end:
+                index = position // self.block_size
+                block = await self.get_block(source_id, source, index)
+                self._read_ahead(source_id, source, index)
+                offset = position - index * self.block_size
+                chunk = block[offset:offset + end - position + 1]
+                if not chunk:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+                position += len(chunk)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            # ffmpeg drops the connection whenever it seeks elsewhere.
+            pass
+        except Exception:
+            traceback.print_exc()
+        finally:
+            writer.close()
+
+
+range_proxy = RangeProxy(
+    Config.PROXY_CACHE_BYTES,
+    Config.PROXY_BLOCK_SIZE,
+    Config.PROXY_READAHEAD,
+    Config.PROXY_UPSTREAM_CONNECTIONS,
+    Config.PROXY_UPSTREAM_TIMEOUT,
+    Config.PROXY_USER_AGENT,
+    Config.PROXY_TLS_VERIFY
+)
+
+metrics.register_cache('proxy_block', range_proxy.cache)
+metrics.gauge('proxy_cached_bytes', 'Bytes held by the range proxy block cache', lambda: range_proxy.cache.size)
+
+
+async def local_link(file_link):
+    if not Config.RANGE_PROXY:
+        return file_link
+    return await range_proxy.local_link(file_link)
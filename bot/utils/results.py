@@ -0,0 +1,61 @@
+import json
+import hashlib
+import traceback
+
+from pyrogram import InputMediaPhoto
+
+from config import Config
+from bot import db
+from .metrics import metrics
+
+
+def get_result_key(media_key, timestamps, settings, as_file, layout=None):
+    key = json.dumps([media_key, timestamps, settings, as_file, Config.SEEK_MODE, layout], sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def get_sent_media(messages):
+    media = []
+    for message in messages:
+        sent = message.document or message.photo
+        if sent is not None:
+            media.append(dict(file_id=sent.file_id, caption=message.caption))
+    return media
+
+
+async def send_cached_screenshots(media_msg, key, as_file):
+    result = await db.get_screenshot_result(key)
+    if result is None:
+        metrics.counter('result_cache_misses_total', 'Screenshot jobs not found in the result cache').inc()
+        return False
+    sent = 0
+    try:
+        if as_file:
+            # one at a time, so the documents arrive in timestamp order.
+            for item in result['media']:
+                await media_msg.reply_document(item['file_id'], quote=True, caption=item['caption'])
+                sent += 1
+        elif len(result['media']) == 1:
+            item = result['media'][0]
+            await media_msg.reply_photo(item['file_id'], quote=True, caption=item['caption'])
+        else:
+            await media_msg.reply_media_group(
+                [InputMediaPhoto(item['file_id'], caption=item['caption']) for item in result['media']],
+                True
+            )
+    except Exception:
+        # file ids can stop working, e.g. after the bot token changes.
+        traceback.print_exc()
+        await db.delete_screenshot_result(key)
+        if sent:
+            # generating the job again would send the delivered documents twice.
+            raise
+        return False
+    metrics.counter('result_cache_hits_total', 'Screenshot jobs answered from the result cache').inc()
+    return True
+
+
+async def save_screenshots(key, messages):
+    media = get_sent_media(messages)
+    if media:
+        await db.save_screenshot_result(key, media)
@@ -0,0 +1,110 @@
+import asyncio
+import traceback
+from collections import OrderedDict, deque
+
+from config import Config
+from .metrics import metrics
+from .utils import job_deadline
+
+
+class JobScheduler:
+
+    def __init__(self, max_running):
+        self.max_running = max_running
+        self.running = 0
+        self._queues = OrderedDict()
+        self._keys = set()
+        self._positions = {}
+        self._tasks = {}
+
+
+    def submit(self, user_id, key, job, on_position=None):
+        # plugins put the user id in their keys: a job's output depends on the
+        # user's settings and goes to their chat, so only repeats of one user
+        # are duplicates. Other users asking for the same shots later are
+        # served from the result cache.
+        if key in self._keys:
+            metrics.counter('jobs_deduplicated_total', 'Jobs rejected as duplicates').inc()
+            return False
+        self._keys.add(key)
+        self._queues.setdefault(user_id, deque()).append((key, job, on_position))
+        self._schedule()
+        return True
+
+
+    def cancel(self, key):
+        task = self._tasks.get(key)
+        if task is not None:
+            task.cancel()
+            return True
+        for user_id, queue in self._queues.items():
+            for item in queue:
+                if item[0] == key:
+                    queue.remove(item)
+                    if not queue:
+                        del self._queues[user_id]
+                    self._keys.discard(key)
+                    self._positions.pop(key, None)
+                    metrics.counter('jobs_cancelled_total', 'Jobs cancelled by users').inc()
+                    self._notify_positions()
+                    return True
+        return False
+
+
+    def pending(self):
+        queues = [list(queue) for queue in self._queues.values()]
+        order = []
+        depth = 0
+        while any(depth < len(queue) for queue in queues):
+            for queue in queues:
+                if depth < len(queue):
+                    order.append(queue[depth])
+            depth += 1
+        return order
+
+
+    def _schedule(self):
+        while self.running < self.max_running and self._queues:
+            # users are served one job at a time in turn; a user with more
+            # jobs waiting goes to the back of the line.
+            user_id, queue = self._queues.popitem(last=False)
+            key, job, _ = queue.popleft()
+            if queue:
+                self._queues[user_id] = queue
+            self._positions.pop(key, None)
+            self.running += 1
+            metrics.counter('jobs_started_total', 'Jobs started').inc()
+            task = self._tasks[key] = asyncio.ensure_future(self._run(job))
+            task.add_done_callback(lambda task, key=key: self._done(task, key))
+        self._notify_positions()
+
+
+    async def _run(self, job):
+        # every subprocess the job starts is bounded by what is left of this.
+        with job_deadline(Config.JOB_TIMEOUT):
+            return await job()
+
+
+    def _done(self, task, key):
+        self.running -= 1
+        self._keys.discard(key)
+        self._tasks.pop(key, None)
+        if task.cancelled():
+            metrics.counter('jobs_cancelled_total', 'Jobs cancelled by users').inc()
+        elif task.exception() is not None:
+            traceback.print_exception(type(task.exception()), task.exception(), task.exception().__traceback__)
+        self._schedule()
+
+
+    def _notify_positions(self):
+        for position, (key, _, on_position) in enumerate(self.pending(), 1):
+            if on_position is None or self._positions.get(key) == position:
+                continue
+            self._positions[key] = position
+            asyncio.ensure_future(on_position(position))
+
+
+scheduler = JobScheduler(Config.MAX_RUNNING_JOBS)
+
+metrics.gauge('jobs_running', 'Jobs currently running', lambda: scheduler.running)
+metrics.gauge('jobs_queued', 'Jobs waiting for a slot', lambda: len(scheduler.pending()))
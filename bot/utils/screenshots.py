@@ -0,0 +1,93 @@
+import os
+import uuid
+import time
+import shutil
+import datetime
+import traceback
+
+from config import Config
+from bot import db
+from .utils import get_probe, get_media_key
+from .extractor import get_timestamps
+from .uploader import Uploader
+from .results import get_result_key, send_cached_screenshots, save_screenshots
+from .log_sink import log_sink
+from .metrics import metrics
+
+
+async def screenshot_job(m, progress, get_file_link, failed_text, failed_report):
+    # tg and url jobs differ only in where the link comes from and in what the
+    # user is told when nothing was generated. get_file_link returns None once
+    # it has told the user why there is no link.
+    from bot.workers import request_screenshots
+
+    _, num_screenshots, *layout = m.data.split('+')
+    num_screenshots = int(num_screenshots)
+    layout = layout[0] if layout else None
+    media_msg = m.message.reply_to_message
+
+    uid = str(uuid.uuid4())
+    output_folder = Config.SCRST_OP_FLDR.joinpath(uid)
+    if not output_folder.exists():
+        os.makedirs(output_folder)
+
+    try:
+        start_time = time.time()
+
+        file_link = await get_file_link(media_msg, progress)
+        if file_link is None:
+            return
+
+        progress.update('😀 Generating screenshots!')
+
+        info = await get_probe(get_media_key(media_msg), file_link)
+        if info is None:
+            progress.finish("😟 Sorry! I cannot open the file.")
+            log_sink.report(f'stream link : {file_link}\n\n{num_screenshots} Could not open the file.', media_msg)
+            return
+
+        timestamps = get_timestamps(info['seconds'], num_screenshots)
+        as_file = await db.is_as_file(m.from_user.id)
+        settings = await db.get_output_settings(m.from_user.id)
+
+        result_key = get_result_key(get_media_key(media_msg), timestamps, settings, as_file, layout)
+        if await send_cached_screenshots(media_msg, result_key, as_file):
+            progress.finish(f'Successfully completed process in {datetime.timedelta(seconds=int(time.time()-start_time))}')
+            return
+
+        async def on_generated(generated, total):
+            progress.update(f'`{generated}` of `{total}` generated, uploading them as they come!')
+
+        def caption(sec):
+            if layout == 'sheet':
+                return f"Contact sheet of {num_screenshots} screenshots"
+            return f"ScreenShot at {datetime.timedelta(seconds=int(sec))}"
+
+        await media_msg.reply_chat_action("upload_photo")
+
+        # frames are uploaded while the rest are still being extracted.
+        uploader = Uploader(media_msg, as_file, output_folder, settings, caption)
+        try:
+            await request_screenshots(file_link, timestamps, settings, on_generated, layout, uploader.put)
+            with metrics.timer('upload_seconds', 'Time spent uploading after extraction finished'):
+                sent = await uploader.finish()
+        except:
+            uploader.cancel()
+            raise
+
+        if not sent:
+            progress.finish(failed_text)
+            log_sink.report(failed_report.format(file_link=file_link, num_screenshots=num_screenshots), media_msg)
+            return
+
+        await save_screenshots(result_key, sent)
+        metrics.histogram('job_seconds', 'End to end time of successful jobs').observe(time.time()-start_time)
+
+        progress.finish(f'Successfully completed process in {datetime.timedelta(seconds=int(time.time()-start_time))}')
+    except:
+        traceback.print_exc()
+        progress.finish('😟 Sorry! Screenshot generation failed possibly due to some infrastructure failure 😥.')
+
+        log_sink.report(f'{num_screenshots} screenshots where requested and some error occoured\n\n{traceback.format_exc()}', media_msg)
+    finally:
+        shutil.rmtree(output_folder, ignore_errors=True)
@@ -0,0 +1,60 @@
+import time
+import zlib
+import asyncio
+
+from config import Config
+from bot import users
+from .metrics import metrics
+
+
+class SessionPool:
+
+    def __init__(self, clients, sharding='least_loaded'):
+        self.clients = list(clients)
+        self.sharding = sharding
+        self._load = {client: 0 for client in self.clients}
+        self._cooldown = {}
+
+
+    def __len__(self):
+        return len(self.clients)
+
+
+    def available(self):
+        now = time.monotonic()
+        return [client for client in self.clients if self._cooldown.get(client, 0) <= now]
+
+
+    def _choose(self, clients, key):
+        if self.sharding == 'hash' and key is not None:
+            # the same file keeps landing on the same account while it is
+            # usable, so its forwards stay in one account's history.
+            return clients[zlib.crc32(key.encode()) % len(clients)]
+        return min(clients, key=lambda client: self._load[client])
+
+
+    async def acquire(self, key=None):
+        while True:
+            clients = self.available()
+            if clients:
+                break
+            # every account is in FloodWait, wait for the first one to come back.
+            await asyncio.sleep(min(self._cooldown.values()) - time.monotonic())
+        client = self._choose(clients, key)
+        self._load[client] += 1
+        return client
+
+
+    def release(self, client):
+        self._load[client] -= 1
+
+
+    def cooldown(self, client, seconds):
+        self._cooldown[client] = time.monotonic() + seconds
+        metrics.counter('session_cooldowns_total', 'User sessions taken out of rotation by FloodWait').inc()
+
+
+session_pool = SessionPool(users, Config.SESSION_SHARDING)
+
+metrics.gauge('sessions_available', 'User sessions not in FloodWait', lambda: len(session_pool.available()))
+metrics.gauge('sessions_busy', 'Link requests in flight across user sessions', lambda: sum(session_pool._load.values()))
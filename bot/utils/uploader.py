@@ -0,0 +1,128 @@
+import asyncio
+
+from pyrogram.api import functions, types
+from pyrogram.client.ext import utils as pyrogram_utils
+
+from config import Config
+from .extractor import frame_to_media
+from .metrics import metrics
+
+
+async def upload_photo(media_msg, media):
+    client = media_msg._client
+    uploaded = await client.send(
+        functions.messages.UploadMedia(
+            peer=await client.resolve_peer(media_msg.chat.id),
+            media=types.InputMediaUploadedPhoto(file=await client.save_file(media))
+        )
+    )
+    photo = uploaded.photo
+    return types.InputMediaPhoto(
+        id=types.InputPhoto(id=photo.id, access_hash=photo.access_hash, file_reference=photo.file_reference)
+    )
+
+
+async def send_uploaded_photos(media_msg, photos):
+    # photos are (uploaded media, caption) pairs; only this last call has to
+    # wait for the whole job, the uploads already happened during extraction.
+    client = media_msg._client
+    peer = await client.resolve_peer(media_msg.chat.id)
+    if len(photos) == 1:
+        media, caption = photos[0]
+        request = functions.messages.SendMedia(
+            peer=peer,
+            media=media,
+            message=caption,
+            random_id=client.rnd_id(),
+            reply_to_msg_id=media_msg.message_id
+        )
+    else:
+        request = functions.messages.SendMultiMedia(
+            peer=peer,
+            multi_media=[
+                types.InputSingleMedia(media=media, random_id=client.rnd_id(), message=caption, entities=[])
+                for media, caption in photos
+            ],
+            reply_to_msg_id=media_msg.message_id
+        )
+    r = await client.send(request)
+    return await pyrogram_utils.parse_messages(
+        client,
+        types.messages.Messages(
+            messages=[update.message for update in r.updates if isinstance(update, (types.UpdateNewMessage, types.UpdateNewChannelMessage))],
+            users=r.users,
+            chats=r.chats
+        )
+    )
+
+
+class Uploader:
+
+    def __init__(self, media_msg, as_file, output_folder, settings, caption, maxsize=Config.UPLOAD_QUEUE_SIZE):
+        self.media_msg = media_msg
+        self.as_file = as_file
+        self.output_folder = output_folder
+        self.settings = settings
+        self.caption = caption
+        self.sent = []
+        self._queue = asyncio.Queue(maxsize)
+        self._ready = {}
+        self._next = 0
+        self._photos = []
+        self._task = asyncio.ensure_future(self._run())
+
+
+    async def _put(self, item):
+        # the queue is bounded, so extraction waits here when uploads fall behind;
+        # if the upload stage died meanwhile its error is raised instead.
+        put = asyncio.ensure_future(self._queue.put(item))
+        await asyncio.wait([put, self._task], return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+            self._task.result()
+
+
+    async def put(self, i, sec, data):
+        await self._put((i, sec, data))
+
+
+    async def finish(self):
+        await self._put(None)
+        return await self._task
+
+
+    def cancel(self):
+        self._task.cancel()
+
+
+    async def _send_documents(self, flush=False):
+        # documents go out in timestamp order even when frames finish out of order.
+        while self._next in self._ready or (flush and self._ready):
+            if self._next not in self._ready:
+                self._next = min(self._ready)
+            sec, media = self._ready.pop(self._next)
+            self._next += 1
+            if media is None:
+                continue
+            self.sent.append(await self.media_msg.reply_document(media, quote=True, caption=self.caption(sec)))
+
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                break
+            i, sec, data = item
+            media = frame_to_media(i + 1, data, self.output_folder, self.settings) if data else None
+            if self.as_file:
+                self._ready[i] = (sec, media)
+                await self._send_documents()
+            elif media is not None:
+                self._photos.append((i, await upload_photo(self.media_msg, media), self.caption(sec)))
+
+        if self.as_file:
+            await self._send_documents(flush=True)
+        elif self._photos:
+            with metrics.timer('album_send_seconds', 'Time to send an album of pre-uploaded photos'):
+                self.sent = await send_uploaded_photos(self.media_msg, [(media, caption) for _, media, caption in sorted(self._photos, key=lambda photo: photo[0])])
+        return self.sent
@@ -1,15 +1,43 @@
 import os
 import re
+import time
 import uuid
 import shlex
+import signal
 import asyncio
 import traceback
+import contextvars
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit
 
-from pyrogram import InputMediaPhoto
+from pyrogram import InputMediaPhoto, InlineKeyboardMarkup, InlineKeyboardButton, MessageHandler, Filters
 from pyrogram.errors import FloodWait
 
 from config import Config
-from bot import user
+from bot import db
+from .cache import TTLCache
+from .metrics import metrics
+from .session_pool import session_pool
+from .range_proxy import local_link
+
+
+OUTPUT_SETTING_CHOICES = dict(
+    output_format = ['png', 'jpeg', 'webp'],
+    quality = [95, 85, 70, 50],
+    max_dimension = [0, 2560, 1920, 1280]
+)
+
+probe_cache = TTLCache(Config.PROBE_CACHE_SIZE, Config.PROBE_CACHE_TTL)
+stream_link_cache = TTLCache(Config.STREAM_LINK_CACHE_SIZE, Config.STREAM_LINK_TTL)
+link_gen_requests = {}
+early_link_gen_replies = TTLCache(256, 60)
+
+_job_deadline = contextvars.ContextVar('job_deadline', default=None)
+subprocess_timeouts = metrics.counter('subprocess_timeouts_total', 'Subprocesses killed for running past their deadline')
+subprocess_kills = metrics.counter('subprocess_killed_total', 'Subprocesses killed on cancellation or output overflow')
+
+metrics.register_cache('probe', probe_cache)
+metrics.register_cache('stream_link', stream_link_cache)
 
 
 
@@ -32,39 +60,213 @@ def is_url(text):
     return False
 
 
-async def run_subprocess(cmd):
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', parts.query, ''))
+
+
+def get_media_key(msg):
+    if msg.text:
+        return f"url:{normalize_url(msg.text)}"
+    media = msg.video or msg.document
+    return f"tg:{getattr(media, 'file_unique_id', None) or media.file_id}"
+
+
+@contextmanager
+def job_deadline(seconds):
+    token = _job_deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _job_deadline.reset(token)
+
+
+def kill_process_group(process):
+    if process.returncode is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+async def read_stream(stream, limit, on_overflow=None):
+    chunks = []
+    size = 0
+    while True:
+        chunk = await stream.read(64 * 1024)
+        if not chunk:
+            break
+        if size < limit:
+            chunks.append(chunk[:limit - size])
+        elif on_overflow is not None:
+            on_overflow()
+            on_overflow = None
+        size += len(chunk)
+    return b''.join(chunks)
+
+
+async def run_subprocess(cmd, timeout=None):
+    timeout = timeout or Config.SUBPROCESS_TIMEOUT
+    deadline = _job_deadline.get()
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            subprocess_timeouts.inc()
+            return b'', b''
+
+    # a session of its own lets us kill the shell and everything it started.
     process = await asyncio.create_subprocess_shell(
         cmd,
         stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True
     )
-    return await process.communicate()
-    
+
+    def _overflow():
+        subprocess_kills.inc()
+        kill_process_group(process)
+
+    async def _communicate():
+        output = await asyncio.gather(
+            read_stream(process.stdout, Config.SUBPROCESS_STDOUT_LIMIT, _overflow),
+            read_stream(process.stderr, Config.SUBPROCESS_STDERR_LIMIT)
+        )
+        await process.wait()
+        return tuple(output)
+
+    try:
+        return await asyncio.wait_for(_communicate(), timeout)
+    except asyncio.TimeoutError:
+        subprocess_timeouts.inc()
+        kill_process_group(process)
+        await process.wait()
+        return b'', b''
+    except asyncio.CancelledError:
+        subprocess_kills.inc()
+        kill_process_group(process)
+        await process.wait()
+        raise
 
 
 async def generate_stream_link(media_msg):
+    return await stream_link_cache.get_or_create(
+        get_media_key(media_msg),
+        lambda: _generate_stream_link(media_msg)
+    )
+
+
+async def _generate_stream_link(media_msg):
+    with metrics.timer('link_generation_seconds', 'Time to get a stream link from the link generator'):
+        return await _request_stream_link(media_msg)
+
+
+async def _request_stream_link(media_msg):
     middle_msg = await media_msg.forward(Config.MIDDLE_MAN)
-    middle_msg = await user.get_messages(Config.MIDDLE_MAN, middle_msg.message_id)
-    link_req_msg = await middle_msg.forward(Config.LINK_GEN_BOT)
-    await user.read_history(Config.LINK_GEN_BOT)
-    await asyncio.sleep(2)
-    link_msg = None
-    async for mes in user.iter_history(Config.LINK_GEN_BOT, limit=10):
-        if mes.reply_to_message and mes.reply_to_message.message_id == link_req_msg.message_id:
-            link_msg = mes
-    if link_msg is None:
+    # an account in FloodWait leaves the rotation and the request moves on to the next one.
+    for _ in range(len(session_pool)):
+        client = await session_pool.acquire(get_media_key(media_msg))
+        try:
+            return await _request_stream_link_with(client, middle_msg.message_id)
+        except FloodWait as e:
+            metrics.counter('floodwait_total', 'FloodWait errors received').inc()
+            session_pool.cooldown(client, e.x)
+        finally:
+            session_pool.release(client)
+    return None
+
+
+async def _request_stream_link_with(client, middle_msg_id):
+    middle_msg = await client.get_messages(Config.MIDDLE_MAN, middle_msg_id)
+    for _ in range(1 + Config.LINK_GEN_RETRIES):
+        link_req_msg = await middle_msg.forward(Config.LINK_GEN_BOT)
+        file_link = await wait_link_gen_reply(client, link_req_msg.message_id)
+        if file_link is not None:
+            await client.read_history(Config.LINK_GEN_BOT)
+            return file_link
+    return None
+
+
+async def wait_link_gen_reply(client, message_id):
+    # message ids are only unique within one account's chat with the link generator.
+    key = (client, message_id)
+    file_link = early_link_gen_replies.pop(key)
+    if file_link is not None:
+        return file_link
+    future = asyncio.get_event_loop().create_future()
+    link_gen_requests[key] = future
+    try:
+        return await asyncio.wait_for(future, Config.LINK_GEN_TIMEOUT)
+    except asyncio.TimeoutError:
         return None
-    return link_msg.text
+    finally:
+        link_gen_requests.pop(key, None)
 
 
-async def get_duration(input_file_link):
-    ffmpeg_dur_cmd = f"ffmpeg -i {shlex.quote(input_file_link)}"
-    output = await run_subprocess(ffmpeg_dur_cmd)
-    print(output[1].decode())
-    duration = re.findall("Duration: (.*?)\.", output[1].decode())
+async def link_gen_reply_handler(c, m):
+    if not m.reply_to_message:
+        return
+    key = (c, m.reply_to_message.message_id)
+    future = link_gen_requests.get(key)
+    if future is None:
+        # the reply can arrive before the forward call returns its message id.
+        early_link_gen_replies.set(key, m.text)
+    elif not future.done():
+        future.set_result(m.text)
+
+
+def register_link_gen_handler(client):
+    client.add_handler(
+        MessageHandler(
+            link_gen_reply_handler,
+            Filters.chat(Config.LINK_GEN_BOT) & Filters.incoming
+        )
+    )
+
+
+def parse_probe(stderr):
+    duration = re.findall(r"Duration: (.*?)\.", stderr)
     if not duration:
         return None
-    return duration[0]
+    hh, mm, ss = [int(i) for i in duration[0].split(":")]
+    info = dict(
+        duration = duration[0],
+        seconds = hh*60*60 + mm*60 + ss,
+        video_codec = None,
+        width = None,
+        height = None,
+        audio_codec = None,
+        keyframes = None
+    )
+    video = re.search(r"Video: (\w+)", stderr)
+    if video:
+        info['video_codec'] = video.group(1)
+    resolution = re.search(r"Video: .*?\b(\d{2,5})x(\d{2,5})\b", stderr)
+    if resolution:
+        info['width'], info['height'] = int(resolution.group(1)), int(resolution.group(2))
+    audio = re.search(r"Audio: (\w+)", stderr)
+    if audio:
+        info['audio_codec'] = audio.group(1)
+    return info
+
+
+async def probe(input_file_link):
+    input_file_link = await local_link(input_file_link)
+    ffmpeg_dur_cmd = f"ffmpeg -i {shlex.quote(input_file_link)}"
+    with metrics.timer('probe_seconds', 'Time to probe a source with ffmpeg'):
+        output = await run_subprocess(ffmpeg_dur_cmd, Config.PROBE_TIMEOUT)
+    return parse_probe(output[1].decode(errors='replace'))
+
+
+async def get_probe(key, input_file_link):
+    return await probe_cache.get_or_create(key, lambda: probe(input_file_link))
+
+
+async def get_duration(input_file_link):
+    info = await probe(input_file_link)
+    if info is None:
+        return None
+    return info['duration']
 
 
 async def edit_message_text(m, **kwargs):
@@ -72,6 +274,29 @@ async def edit_message_text(m, **kwargs):
         try:
             return await m.edit_message_text(**kwargs)
         except FloodWait as e:
+            metrics.counter('floodwait_total', 'FloodWait errors received').inc()
             await asyncio.sleep(e.x)
         except:
             break
+
+
+def next_choice(field, value):
+    choices = OUTPUT_SETTING_CHOICES[field]
+    if value not in choices:
+        return choices[0]
+    return choices[(choices.index(value) + 1) % len(choices)]
+
+
+async def get_settings_markup(user_id):
+    as_file = await db.is_as_file(user_id)
+    settings = await db.get_output_settings(user_id)
+    upload_mode_btn = [InlineKeyboardButton("📁 Uploading as Document.", 'as_file+0')] if as_file else [InlineKeyboardButton("🖼️ Uploading as Image.", 'as_file+1')]
+    max_dimension = f"{settings['max_dimension']}px" if settings['max_dimension'] else 'Original'
+    return InlineKeyboardMarkup(
+        [
+            upload_mode_btn,
+            [InlineKeyboardButton(f"🎨 Format: {settings['output_format'].upper()}", f"output+output_format+{next_choice('output_format', settings['output_format'])}")],
+            [InlineKeyboardButton(f"✨ Quality: {settings['quality']}", f"output+quality+{next_choice('quality', settings['quality'])}")],
+            [InlineKeyboardButton(f"📐 Max size: {max_dimension}", f"output+max_dimension+{next_choice('max_dimension', settings['max_dimension'])}")]
+        ]
+    )
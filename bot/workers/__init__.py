@@ -0,0 +1,34 @@
+import asyncio
+
+from config import Config
+from bot import db
+from bot.utils import extract_screenshots, deliver_frames
+from .queue import LocalJobQueue, MongoJobQueue, JobFailed
+from .worker import run_worker, process_job
+
+
+job_queue = None
+
+
+def get_job_queue():
+    global job_queue
+    if job_queue is None:
+        if Config.EXTRACTION_BACKEND == 'mongo':
+            job_queue = MongoJobQueue(db.db)
+        else:
+            job_queue = LocalJobQueue()
+            asyncio.ensure_future(run_worker(job_queue))
+    return job_queue
+
+
+async def request_screenshots(file_link, timestamps, settings=None, progress=None, layout=None, on_frame=None):
+    if Config.EXTRACTION_BACKEND == 'inline':
+        return await extract_screenshots(file_link, timestamps, progress, settings=settings, layout=layout, on_frame=on_frame)
+
+    queue = get_job_queue()
+    job_id = await queue.put(dict(file_link=file_link, timestamps=timestamps, settings=settings, layout=layout))
+    frames = await queue.wait(job_id, Config.WORKER_JOB_TIMEOUT)
+    if progress is not None:
+        await progress(len(timestamps) if frames else 0, len(timestamps))
+    # worker backends hand back the whole job at once.
+    return await deliver_frames(frames, on_frame)
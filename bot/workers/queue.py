@@ -0,0 +1,116 @@
+import uuid
+import asyncio
+import datetime
+
+from pymongo import ReturnDocument
+
+from config import Config
+
+
+class JobFailed(Exception):
+    pass
+
+
+class LocalJobQueue:
+
+    def __init__(self):
+        self._jobs = asyncio.Queue()
+        self._results = {}
+
+
+    async def put(self, job):
+        job_id = uuid.uuid4().hex
+        self._results[job_id] = asyncio.get_event_loop().create_future()
+        await self._jobs.put((job_id, job))
+        return job_id
+
+
+    async def get(self):
+        return await self._jobs.get()
+
+
+    async def complete(self, job_id, frames=None, error=None):
+        future = self._results.get(job_id)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(JobFailed(error))
+        else:
+            future.set_result(frames)
+
+
+    async def wait(self, job_id, timeout):
+        try:
+            return await asyncio.wait_for(self._results[job_id], timeout)
+        finally:
+            self._results.pop(job_id, None)
+
+
+class MongoJobQueue:
+
+    def __init__(self, db, poll_interval=0.5):
+        self.jobs = db.jobs
+        self.frames = db.frames
+        self.poll_interval = poll_interval
+
+
+    async def create_indexes(self):
+        await self.jobs.create_index([('status', 1), ('created', 1)])
+        await self.frames.create_index([('job_id', 1), ('index', 1)])
+        await self.frames.create_index('created', expireAfterSeconds=Config.WORKER_JOB_TIMEOUT*2)
+
+
+    async def put(self, job):
+        job_id = uuid.uuid4().hex
+        await self.jobs.insert_one(dict(
+            _id = job_id,
+            status = 'pending',
+            created = datetime.datetime.utcnow(),
+            job = job
+        ))
+        return job_id
+
+
+    async def get(self):
+        while True:
+            # a job left running past the timeout belongs to a worker that died.
+            stale = datetime.datetime.utcnow() - datetime.timedelta(seconds=Config.WORKER_JOB_TIMEOUT)
+            doc = await self.jobs.find_one_and_update(
+                {'$or': [{'status': 'pending'}, {'status': 'running', 'started': {'$lt': stale}}]},
+                {'$set': {'status': 'running', 'started': datetime.datetime.utcnow()}},
+                sort=[('created', 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if doc is not None:
+                return doc['_id'], doc['job']
+            await asyncio.sleep(self.poll_interval)
+
+
+    async def complete(self, job_id, frames=None, error=None):
+        if error is not None:
+            await self.jobs.update_one({'_id': job_id}, {'$set': {'status': 'failed', 'error': error}})
+            return
+        now = datetime.datetime.utcnow()
+        if frames:
+            await self.frames.insert_many([
+                dict(job_id=job_id, index=i, sec=sec, data=data, created=now) for i, (sec, data) in enumerate(frames)
+            ])
+        await self.jobs.update_one({'_id': job_id}, {'$set': {'status': 'done'}})
+
+
+    async def wait(self, job_id, timeout):
+        try:
+            deadline = asyncio.get_event_loop().time() + timeout
+            while True:
+                doc = await self.jobs.find_one({'_id': job_id}, {'status': 1, 'error': 1})
+                if doc['status'] == 'failed':
+                    raise JobFailed(doc.get('error'))
+                if doc['status'] == 'done':
+                    break
+                if asyncio.get_event_loop().time() > deadline:
+                    raise asyncio.TimeoutError()
+                await asyncio.sleep(self.poll_interval)
+            return [(frame['sec'], frame['data']) async for frame in self.frames.find({'job_id': job_id}).sort('index', 1)]
+        finally:
+            await self.jobs.delete_one({'_id': job_id})
+            await self.frames.delete_many({'job_id': job_id})
@@ -0,0 +1,26 @@
+import asyncio
+import traceback
+
+from config import Config
+from bot.utils import extract_screenshots, job_deadline
+
+
+async def process_job(job):
+    with job_deadline(Config.WORKER_JOB_TIMEOUT):
+        return await extract_screenshots(job['file_link'], job['timestamps'], mode=job.get('mode'), settings=job.get('settings'), layout=job.get('layout'))
+
+
+async def run_worker(queue, concurrency=Config.WORKER_CONCURRENCY):
+
+    async def _loop():
+        while True:
+            job_id, job = await queue.get()
+            try:
+                frames = await process_job(job)
+            except Exception:
+                traceback.print_exc()
+                await queue.complete(job_id, error=traceback.format_exc())
+            else:
+                await queue.complete(job_id, frames)
+
+    await asyncio.gather(*[_loop() for _ in range(concurrency)])
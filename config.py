@@ -8,6 +8,8 @@ class Config:
     BOT_TOKEN = os.environ.get('BOT_TOKEN')
     SESSION_NAME = os.environ.get('SESSION_NAME')
     USER_SESSION_STRING = os.environ.get('USER_SESSION_STRING')
+    USER_SESSION_STRINGS = os.environ.get('USER_SESSION_STRINGS', '').split() or [USER_SESSION_STRING]
+    SESSION_SHARDING = os.environ.get('SESSION_SHARDING', 'least_loaded')
     MIDDLE_MAN = int(os.environ.get('MIDDLE_MAN'))
     LINK_GEN_BOT = os.environ.get('LINK_GEN_BOT')
     LOG_CHANNEL = int(os.environ.get('LOG_CHANNEL'))
@@ -15,3 +17,53 @@ class Config:
     AUTH_USERS = [int(i) for i in os.environ.get('AUTH_USERS', '').split(' ')]
     
     SCRST_OP_FLDR = Path('screenshots/')
+    PROGRESS_INTERVAL = int(os.environ.get('PROGRESS_INTERVAL', 3))
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 200))
+    LOG_FLUSH_INTERVAL = int(os.environ.get('LOG_FLUSH_INTERVAL', 30))
+    METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+    RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 50000))
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+    IN_MEMORY_UPLOADS = os.environ.get('IN_MEMORY_UPLOADS', '') == 'True'
+    MAX_FFMPEG_PROCS = int(os.environ.get('MAX_FFMPEG_PROCS', os.cpu_count() or 1))
+    SCREENSHOT_FANOUT = int(os.environ.get('SCREENSHOT_FANOUT', 4))
+    UPLOAD_QUEUE_SIZE = int(os.environ.get('UPLOAD_QUEUE_SIZE', 4))
+    MAX_RUNNING_JOBS = int(os.environ.get('MAX_RUNNING_JOBS', 4))
+    EXTRACTION_BACKEND = os.environ.get('EXTRACTION_BACKEND', 'inline')
+    WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', os.cpu_count() or 1))
+    WORKER_JOB_TIMEOUT = int(os.environ.get('WORKER_JOB_TIMEOUT', 300))
+    SCREENSHOT_MODE = os.environ.get('SCREENSHOT_MODE', 'auto')
+    SEEK_MODE = os.environ.get('SEEK_MODE', 'accurate')
+    SELECT_MAX_INTERVAL = int(os.environ.get('SELECT_MAX_INTERVAL', 30))
+    SHEET_SIZES = [int(n) for n in os.environ.get('SHEET_SIZES', '9 16').split()]
+    SHEET_COLUMNS = int(os.environ.get('SHEET_COLUMNS', 0))
+    SHEET_TILE_WIDTH = int(os.environ.get('SHEET_TILE_WIDTH', 480))
+    SHEET_LABELS = os.environ.get('SHEET_LABELS', 'True') == 'True'
+    SUBPROCESS_TIMEOUT = int(os.environ.get('SUBPROCESS_TIMEOUT', 120))
+    PROBE_TIMEOUT = int(os.environ.get('PROBE_TIMEOUT', 30))
+    JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', 600))
+    SUBPROCESS_STDOUT_LIMIT = int(os.environ.get('SUBPROCESS_STDOUT_LIMIT', 256 * 1024 * 1024))
+    SUBPROCESS_STDERR_LIMIT = int(os.environ.get('SUBPROCESS_STDERR_LIMIT', 64 * 1024))
+    SMART_SIZES = [int(n) for n in os.environ.get('SMART_SIZES', '5 10').split()]
+    SMART_OVERSAMPLE = int(os.environ.get('SMART_OVERSAMPLE', 3))
+    SMART_TIMEOUT = int(os.environ.get('SMART_TIMEOUT', 20))
+    SMART_PROBESIZE = int(os.environ.get('SMART_PROBESIZE', 2 * 1024 * 1024))
+    SMART_BLACK_LEVEL = int(os.environ.get('SMART_BLACK_LEVEL', 24))
+    CLIP_DURATION = int(os.environ.get('CLIP_DURATION', 10))
+    CLIP_OFFSETS = [int(n) for n in os.environ.get('CLIP_OFFSETS', '10 25 50 75').split()]
+    CLIP_MAX_HEIGHT = int(os.environ.get('CLIP_MAX_HEIGHT', 720))
+    GIF_WIDTH = int(os.environ.get('GIF_WIDTH', 320))
+    GIF_FPS = int(os.environ.get('GIF_FPS', 10))
+    PROBE_CACHE_SIZE = int(os.environ.get('PROBE_CACHE_SIZE', 1024))
+    PROBE_CACHE_TTL = int(os.environ.get('PROBE_CACHE_TTL', 6*60*60))
+    STREAM_LINK_CACHE_SIZE = int(os.environ.get('STREAM_LINK_CACHE_SIZE', 1024))
+    STREAM_LINK_TTL = int(os.environ.get('STREAM_LINK_TTL', 3*60*60))
+    RANGE_PROXY = os.environ.get('RANGE_PROXY', 'True') == 'True'
+    PROXY_CACHE_BYTES = int(os.environ.get('PROXY_CACHE_BYTES', 256 * 1024 * 1024))
+    PROXY_BLOCK_SIZE = int(os.environ.get('PROXY_BLOCK_SIZE', 1024 * 1024))
+    PROXY_READAHEAD = int(os.environ.get('PROXY_READAHEAD', 2))
+    PROXY_UPSTREAM_CONNECTIONS = int(os.environ.get('PROXY_UPSTREAM_CONNECTIONS', 8))
+    PROXY_UPSTREAM_TIMEOUT = int(os.environ.get('PROXY_UPSTREAM_TIMEOUT', 30))
+    PROXY_USER_AGENT = os.environ.get('PROXY_USER_AGENT', 'Lavf/58.76.100')
+    PROXY_TLS_VERIFY = os.environ.get('PROXY_TLS_VERIFY', 'False') == 'True'
+    LINK_GEN_TIMEOUT = int(os.environ.get('LINK_GEN_TIMEOUT', 15))
+    LINK_GEN_RETRIES = int(os.environ.get('LINK_GEN_RETRIES', 1))
@@ -0,0 +1,15 @@
+import asyncio
+
+from bot import db
+from bot.workers import MongoJobQueue, run_worker
+
+
+async def run_extractor():
+    queue = MongoJobQueue(db.db)
+    await queue.create_indexes()
+    await run_worker(queue)
+
+
+if __name__ == "__main__":
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run_extractor())